@@ -0,0 +1,194 @@
+"""
+Glove and stick side analysis of the shots against a goalie.
+
+Every function works on NumPy arrays of the event type and the x and y
+coordinates of the shots, so the same code handles a single goalie-season in
+the viewer or every goalie-season in the database at once.
+
+A shot from the first or third quadrant, (+x, +y) or (-x, -y), is a shot to the
+goalie's left side, and a shot from the second or fourth quadrant is a shot to
+the goalie's right side. Goals, shots and blocked shots count as shots that the
+goalie had to act on, missed shots do not. Events without coordinates are not
+counted.
+"""
+from typing import NamedTuple
+import numpy as np
+
+
+SHOT_EVENTS = ("Goal", "Blocked Shot", "Shot")
+GOAL_EVENT = "Goal"
+SIDES = ("left", "right")
+
+
+class SideCounts(NamedTuple):
+    """
+    Shots and goals on each side, one entry per group
+    """
+    leftShots: np.ndarray
+    leftGoals: np.ndarray
+    rightShots: np.ndarray
+    rightGoals: np.ndarray
+
+
+def columns_from_rows(rows, eventTypeIndex=0, xIndex=-2, yIndex=-1):
+    """
+    Event type, x and y arrays from rows read from the database. Missing
+    coordinates become NaN.
+    """
+    eventType = np.array([row[eventTypeIndex] for row in rows], dtype=object)
+    x = np.array([row[xIndex] for row in rows], dtype=np.float64)
+    y = np.array([row[yIndex] for row in rows], dtype=np.float64)
+    return eventType, x, y
+
+
+def has_coordinates(x, y):
+    return ~(np.isnan(x) | np.isnan(y))
+
+
+def side_masks(x, y):
+    """
+    Masks of the events to the left and to the right side of the goalie. Events
+    without coordinates are in neither.
+    """
+    valid = has_coordinates(x, y)
+    left = ((x >= 0) & (y >= 0)) | ((x < 0) & (y < 0))
+    return valid & left, valid & ~left
+
+
+def side_counts(eventType, x, y, groups=None, ngroups=None,
+                shotEvents=SHOT_EVENTS, goalEvents=(GOAL_EVENT,)):
+    """
+    Shots and goals to each side. When groups is given (an integer group number
+    for each event, e.g. one per goalie-season) the counts are returned for every
+    group, otherwise for a single group holding every event. The event types can
+    be codes (see columnar.py) when shotEvents and goalEvents are codes too.
+    """
+    eventType = np.asarray(eventType)
+    if groups is None:
+        groups = np.zeros(len(eventType), dtype=np.intp)
+        ngroups = 1
+    elif ngroups is None:
+        ngroups = int(groups.max()) + 1 if len(groups) else 0
+
+    shots = np.isin(eventType, shotEvents)
+    goals = np.isin(eventType, goalEvents)
+    left, right = side_masks(x, y)
+
+    def count(mask):
+        return np.bincount(groups[mask], minlength=ngroups)
+
+    return SideCounts(
+        count(shots & left),
+        count(goals & left),
+        count(shots & right),
+        count(goals & right),
+    )
+
+
+def save_percentage(shots, goals):
+    """
+    Save percentage for each entry, 0 where there were no shots.
+    """
+    shots = np.asarray(shots, dtype=np.float64)
+    goals = np.asarray(goals, dtype=np.float64)
+    result = np.zeros(shots.shape, dtype=np.float64)
+    np.divide(shots - goals, shots, out=result, where=shots > 0)
+    return result * 100.0
+
+
+def glove_side(shootsCatches):
+    """
+    Side of the glove hand. A goalie that catches left is more than likely right
+    handed.
+    """
+    return "left" if shootsCatches == "L" else "right"
+
+
+def side_records(counts, shootsCatches, group=0):
+    """
+    Records for a single group in the form shown by the viewer, and the key of the
+    weaker side (the lower save percentage). A side without shots is never the
+    weaker side.
+    """
+    glove = glove_side(shootsCatches)
+    shots = {"left": counts.leftShots[group], "right": counts.rightShots[group]}
+    goals = {"left": counts.leftGoals[group], "right": counts.rightGoals[group]}
+
+    records = {}
+    weakKey = None
+    weakPercent = 100
+    for key in SIDES:
+        savePercent = float(save_percentage(shots[key], goals[key]))
+        records[key] = {
+            "side": "glove" if key == glove else "stick",
+            "shots": int(shots[key]),
+            "goals": int(goals[key]),
+            "savePercentage": savePercent,
+        }
+
+        if shots[key] and savePercent < weakPercent:
+            weakPercent = savePercent
+            weakKey = key
+
+    return records, weakKey
+
+
+def weak_sides(counts):
+    """
+    Key of the weaker side for every group, the same choice as side_records:
+    "left", "right" or None.
+    """
+    leftPercent = save_percentage(counts.leftShots, counts.leftGoals)
+    rightPercent = save_percentage(counts.rightShots, counts.rightGoals)
+
+    leftWeak = (np.asarray(counts.leftShots) > 0) & (leftPercent < 100)
+    rightWeak = (np.asarray(counts.rightShots) > 0) & (
+        rightPercent < np.where(leftWeak, leftPercent, 100)
+    )
+    return np.where(rightWeak, "right", np.where(leftWeak, "left", None))
+
+
+def glove_stick(counts, shootsCatches):
+    """
+    Shots, goals and save percentage to the glove and stick side, and the weaker
+    of the two, for every group. shootsCatches holds the value of each group.
+    """
+    catchesLeft = np.asarray(shootsCatches, dtype=object) == "L"
+    gloveShots = np.where(catchesLeft, counts.leftShots, counts.rightShots)
+    gloveGoals = np.where(catchesLeft, counts.leftGoals, counts.rightGoals)
+    stickShots = np.where(catchesLeft, counts.rightShots, counts.leftShots)
+    stickGoals = np.where(catchesLeft, counts.rightGoals, counts.leftGoals)
+
+    weak = weak_sides(counts)
+    gloveWeak = np.where(catchesLeft, weak == "left", weak == "right")
+    stickWeak = np.where(catchesLeft, weak == "right", weak == "left")
+
+    return {
+        "gloveShots": gloveShots,
+        "gloveGoals": gloveGoals,
+        "gloveSavePercentage": save_percentage(gloveShots, gloveGoals),
+        "stickShots": stickShots,
+        "stickGoals": stickGoals,
+        "stickSavePercentage": save_percentage(stickShots, stickGoals),
+        "weakSide": np.where(gloveWeak, "glove", np.where(stickWeak, "stick", None)),
+    }
+
+
+# The coordinates of the rink, in feet, and the size of the heatmap bins
+RINK_X = (-100.0, 100.0)
+RINK_Y = (-42.5, 42.5)
+DENSITY_BIN_SIZE = 2.5
+
+
+def shot_density(x, y, binSize=DENSITY_BIN_SIZE):
+    """
+    Number of events in each bin of the rink, indexed [x bin, y bin]. Events
+    without coordinates or outside of the rink are not counted.
+    """
+    bins = (
+        int(round((RINK_X[1] - RINK_X[0]) / binSize)),
+        int(round((RINK_Y[1] - RINK_Y[0]) / binSize)),
+    )
+    valid = has_coordinates(x, y)
+    density, _, _ = np.histogram2d(x[valid], y[valid], bins=bins, range=(RINK_X, RINK_Y))
+    return density
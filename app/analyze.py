@@ -0,0 +1,317 @@
+"""
+Glove/stick analysis of every goalie and season without the viewer.
+
+The shots of each season are counted in a separate process, so the whole
+history is spread over every core. With --columns the shots are read from the
+column store (see columnar.py) rather than from the database. The results can
+be written as csv, json or parquet (requires pyarrow), and nothing here needs a
+display.
+
+    python analyze.py --db nhl.db -o sides.csv
+    python analyze.py --seasons 20202021 20212022 --min-shots 100 -f json
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from analytics import SHOT_EVENTS, GOAL_EVENT, side_counts, glove_stick
+from columnar import ColumnStore
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+FORMATS = ["csv", "json", "parquet"]
+
+COLUMNS = [
+    "goalieId",
+    "firstName",
+    "lastName",
+    "shootsCatches",
+    "season",
+    "gloveShots",
+    "gloveGoals",
+    "gloveSavePercentage",
+    "stickShots",
+    "stickGoals",
+    "stickSavePercentage",
+    "weakSide",
+    "gap",
+]
+
+
+def connect(dbfile):
+    """
+    Read only connection to the database
+    """
+    return sqlite3.connect(f"file:{os.path.abspath(dbfile)}?mode=ro", uri=True)
+
+
+def _in(column, values):
+    """
+    Filter on the column for the values, nothing is filtered when values is empty.
+    """
+    if not values:
+        return "", []
+    return f" AND {column} IN ({', '.join('?' * len(values))})", list(values)
+
+
+def find_seasons(dbfile, seasons=None, goalies=None):
+    """
+    Seasons in the database, limited to the selected seasons and goalies
+    """
+    seasonFilter, seasonParams = _in("season", seasons)
+    goalieFilter, goalieParams = _in("goalieId", goalies)
+    con = connect(dbfile)
+    try:
+        cur = con.execute(
+            f"SELECT DISTINCT season FROM shots WHERE true{seasonFilter}{goalieFilter}",
+            seasonParams + goalieParams
+        )
+        return sorted(row[0] for row in cur.fetchall())
+    finally:
+        con.close()
+
+
+def count_season(dbfile, season, goalies=None):
+    """
+    Shots and goals to each side for every goalie of the season. Run in a worker
+    process, each worker has its own connection.
+    """
+    goalieFilter, goalieParams = _in("goalieId", goalies)
+    con = connect(dbfile)
+    try:
+        cur = con.execute(
+            f"""
+            SELECT goalieId, eventType, xCoordinate, yCoordinate FROM shots
+            WHERE season = ? AND xCoordinate IS NOT NULL AND yCoordinate IS NOT NULL
+            {goalieFilter}
+            """,
+            [season] + goalieParams
+        )
+        rows = cur.fetchall()
+    finally:
+        con.close()
+
+    if not rows:
+        return season, np.empty(0, dtype=np.int64), None
+
+    goalieIds, eventType, x, y = zip(*rows)
+    x = np.array(x, dtype=np.float64)
+    y = np.array(y, dtype=np.float64)
+    goalieIds, groups = np.unique(np.array(goalieIds, dtype=np.int64), return_inverse=True)
+    counts = side_counts(np.array(eventType, dtype=object), x, y, groups, len(goalieIds))
+    return season, goalieIds, counts
+
+
+def count_season_columns(directory, season, goalies=None):
+    """
+    Shots and goals to each side for every goalie of the season, from the column
+    store. Run in a worker process.
+    """
+    store = ColumnStore(directory)
+    columns = store.season(season)
+    goalieIds = columns.goalies.astype(np.int64)
+    groups = columns.groups()
+    counts = side_counts(
+        columns["eventType"], columns["x"], columns["y"], groups, len(goalieIds),
+        shotEvents=store.codes("eventType", SHOT_EVENTS),
+        goalEvents=store.codes("eventType", [GOAL_EVENT])
+    )
+
+    # goalies without any shot with coordinates are left out, like count_season
+    events = np.bincount(
+        groups[~(np.isnan(columns["x"]) | np.isnan(columns["y"]))], minlength=len(goalieIds)
+    )
+    keep = events > 0
+    if goalies:
+        keep &= np.isin(goalieIds, goalies)
+    return season, goalieIds[keep], type(counts)(*(count[keep] for count in counts))
+
+
+def analyze(dbfile, seasons=None, goalies=None, minShots=0, workers=None, columns=None):
+    """
+    Glove/stick records of every goalie and season that match the filters, one
+    dictionary per goalie-season with the keys in COLUMNS. The shots are read from
+    the column store in the columns directory when it is set, the store is brought
+    up to date first.
+    """
+    con = connect(dbfile)
+    try:
+        players = {
+            row[0]: row[1:]
+            for row in con.execute(
+                "SELECT playerId, firstName, lastName, shootsCatches FROM players"
+            )
+        }
+    finally:
+        con.close()
+
+    seasonList = find_seasons(dbfile, seasons, goalies)
+
+    count, source = count_season, dbfile
+    if columns is not None:
+        ColumnStore(columns).update(dbfile)
+        count, source = count_season_columns, columns
+
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(count, source, season, goalies) for season in seasonList
+        ]
+        for future in futures:
+            season, goalieIds, counts = future.result()
+            if not len(goalieIds):
+                continue
+
+            info = [players.get(int(goalieId), (None, None, None)) for goalieId in goalieIds]
+            sides = glove_stick(counts, [row[2] for row in info])
+            gap = np.abs(sides["gloveSavePercentage"] - sides["stickSavePercentage"])
+            # a side without shots has no save percentage to compare, like
+            # ShotDatabase.weak_side_gaps the gap needs a shot to each side
+            hasGap = (sides["gloveShots"] > 0) & (sides["stickShots"] > 0)
+
+            for i, goalieId in enumerate(goalieIds):
+                if min(sides["gloveShots"][i], sides["stickShots"][i]) < minShots:
+                    continue
+                results.append({
+                    "goalieId": int(goalieId),
+                    "firstName": info[i][0],
+                    "lastName": info[i][1],
+                    "shootsCatches": info[i][2],
+                    "season": season,
+                    "gloveShots": int(sides["gloveShots"][i]),
+                    "gloveGoals": int(sides["gloveGoals"][i]),
+                    "gloveSavePercentage": float(sides["gloveSavePercentage"][i]),
+                    "stickShots": int(sides["stickShots"][i]),
+                    "stickGoals": int(sides["stickGoals"][i]),
+                    "stickSavePercentage": float(sides["stickSavePercentage"][i]),
+                    "weakSide": sides["weakSide"][i],
+                    "gap": float(gap[i]) if hasGap[i] else None,
+                })
+
+    return results
+
+
+def write_csv(results, output):
+    writer = csv.DictWriter(output, fieldnames=COLUMNS)
+    writer.writeheader()
+    writer.writerows(results)
+
+
+def write_json(results, output):
+    json.dump(results, output, indent=2)
+    output.write("\n")
+
+
+def write_parquet(results, path):
+    if pyarrow is None:
+        raise ImportError("the pyarrow package is required for the parquet format")
+    table = pyarrow.Table.from_pylist(results) if results else pyarrow.table(
+        {column: [] for column in COLUMNS}
+    )
+    pyarrow.parquet.write_table(table, path)
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Glove/stick analysis of every goalie and season: ')
+    parser.add_argument(
+        '--db',
+        type=str,
+        help='Sqlite database created by NhlDB.py.',
+        default="nhl.db"
+    )
+    parser.add_argument(
+        '--seasons',
+        type=int,
+        nargs='+',
+        help='Only analyze these seasons (e.g. 20212022).',
+        default=None
+    )
+    parser.add_argument(
+        '--goalies',
+        type=int,
+        nargs='+',
+        help='Only analyze these goalies (player ids).',
+        default=None
+    )
+    parser.add_argument(
+        '--min-shots',
+        type=int,
+        help='Skip goalie-seasons with fewer shots than this to either side.',
+        default=0
+    )
+    parser.add_argument(
+        '--sort',
+        choices=["gap", "season"],
+        help='Order of the results, gap puts the largest glove/stick gap first and '
+             'the goalie-seasons without a shot to one side last.',
+        default="season"
+    )
+    parser.add_argument(
+        '--columns',
+        type=str,
+        help='Read the shots from the column store in this directory (see columnar.py).',
+        default=None
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        help='Number of processes, defaults to the number of cores.',
+        default=None
+    )
+    parser.add_argument(
+        '-f', '--format',
+        choices=FORMATS,
+        help='Output format, defaults to the extension of the output file or csv.',
+        default=None
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        help='Output file, csv and json are written to stdout when not set.',
+        default=None
+    )
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        extension = os.path.splitext(args.output or "")[1].lstrip(".")
+        fmt = extension if extension in FORMATS else "csv"
+    if fmt == "parquet" and pyarrow is None:
+        parser.error("the pyarrow package is required for the parquet format")
+    if fmt == "parquet" and args.output is None:
+        parser.error("parquet output requires --output")
+
+    results = analyze(
+        args.db, args.seasons, args.goalies, args.min_shots, args.workers, args.columns
+    )
+    if args.sort == "gap":
+        results.sort(
+            key=lambda result: (result["gap"] is not None, result["gap"] or 0.0), reverse=True
+        )
+
+    if fmt == "parquet":
+        write_parquet(results, args.output)
+        return
+
+    writer = write_csv if fmt == "csv" else write_json
+    if args.output is None:
+        writer(results, sys.stdout)
+    else:
+        with open(args.output, "w", newline="") as output:
+            writer(results, output)
+
+
+if __name__ == "__main__":
+    main()
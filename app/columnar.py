@@ -0,0 +1,276 @@
+"""
+Column store of the shots for bulk analysis.
+
+Each season of the shots table is written to its own directory as one file per
+column, so the columns can be memory mapped with NumPy and sliced without
+creating a Python object per row:
+
+    shots.columns/
+        meta.json               codes of the categorical columns, and the version
+                                and number of rows of every season
+        20212022/
+            goalieId.i4         int32
+            gameId.i4           int32
+            eventType.u1        uint8 code, see meta.json
+            periodType.u1       uint8 code, see meta.json
+            x.f4, y.f4          float32, NaN where there are no coordinates
+            goalies.i4          int32 goalie ids in order
+            offsets.i8          int64 first row of each goalie, and the row count
+
+The rows of a season are ordered by goalie, so the shots of one goalie are a
+single slice. Code 0 of a categorical column is a missing value.
+
+The store is rebuilt one season at a time from the database, only the seasons
+whose version in the season_versions table changed are read again.
+
+    python columnar.py --db nhl.db --dir shots.columns
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import numpy as np
+
+
+META = "meta.json"
+
+# name, file suffix and type of every column of a season
+COLUMNS = [
+    ("goalieId", "i4", np.int32),
+    ("gameId", "i4", np.int32),
+    ("eventType", "u1", np.uint8),
+    ("periodType", "u1", np.uint8),
+    ("x", "f4", np.float32),
+    ("y", "f4", np.float32),
+]
+CATEGORIES = ["eventType", "periodType"]
+
+
+def _column_file(directory, name, suffix):
+    return os.path.join(directory, f"{name}.{suffix}")
+
+
+def _read_column(path, dtype, rows):
+    if rows == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(rows,))
+
+
+class SeasonColumns:
+    """
+    Memory mapped columns of a single season
+    """
+
+    def __init__(self, directory, season, rows):
+        self.season = season
+        self.rows = rows
+        self.columns = {
+            name: _read_column(_column_file(directory, name, suffix), dtype, rows)
+            for name, suffix, dtype in COLUMNS
+        }
+        self.goalies = np.fromfile(_column_file(directory, "goalies", "i4"), dtype=np.int32)
+        self.offsets = np.fromfile(_column_file(directory, "offsets", "i8"), dtype=np.int64)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def goalie_slice(self, goalieId):
+        """
+        Rows of the goalie, an empty slice when the goalie has no shots in the season
+        """
+        i = np.searchsorted(self.goalies, goalieId)
+        if i == len(self.goalies) or self.goalies[i] != goalieId:
+            return slice(0, 0)
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def goalie(self, goalieId):
+        """
+        Columns of the shots against the goalie, views of the mapped files
+        """
+        rows = self.goalie_slice(goalieId)
+        return {name: column[rows] for name, column in self.columns.items()}
+
+    def groups(self):
+        """
+        Index of the goalie (in goalies) of every row
+        """
+        return np.repeat(np.arange(len(self.goalies)), np.diff(self.offsets))
+
+
+class ColumnStore:
+    """
+    Reader and writer of the column store in a directory
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta = {"categories": {name: [None] for name in CATEGORIES}, "seasons": {}}
+        path = os.path.join(directory, META)
+        if os.path.exists(path):
+            with open(path) as metaFile:
+                self.meta = json.load(metaFile)
+
+    def _season_dir(self, season):
+        return os.path.join(self.directory, str(season))
+
+    def seasons(self):
+        return sorted(int(season) for season in self.meta["seasons"])
+
+    def season(self, season):
+        info = self.meta["seasons"][str(season)]
+        return SeasonColumns(self._season_dir(season), season, info["rows"])
+
+    def categories(self, name):
+        """
+        Values of the codes of a categorical column, index = code
+        """
+        return self.meta["categories"][name]
+
+    def codes(self, name, values):
+        """
+        Codes of the values in a categorical column, values that were never stored
+        are left out.
+        """
+        categories = self.categories(name)
+        return np.array([categories.index(v) for v in values if v in categories], dtype=np.uint8)
+
+    def decode(self, name, codes):
+        return np.array(self.categories(name), dtype=object)[codes]
+
+    def _save_meta(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, META)
+        with open(path + ".tmp", "w") as metaFile:
+            json.dump(self.meta, metaFile, indent=2)
+        os.replace(path + ".tmp", path)
+
+    def _encode(self, name, values):
+        categories = self.meta["categories"][name]
+        lookup = {value: code for code, value in enumerate(categories)}
+        codes = np.empty(len(values), dtype=np.uint8)
+        for i, value in enumerate(values):
+            code = lookup.get(value)
+            if code is None:
+                # codes are only ever added, so the other seasons stay valid
+                if len(categories) > np.iinfo(np.uint8).max:
+                    raise ValueError(f"too many values of {name}")
+                code = lookup[value] = len(categories)
+                categories.append(value)
+            codes[i] = code
+        return codes
+
+    def _write_season(self, con, season):
+        rows = con.execute(
+            """
+            SELECT goalieId, gameId, eventType, periodType, xCoordinate, yCoordinate
+            FROM shots WHERE season = ? ORDER BY goalieId, gameId, eventId
+            """,
+            (season,)
+        ).fetchall()
+        goalieId, gameId, eventType, periodType, x, y = zip(*rows) if rows else ([],) * 6
+
+        columns = {
+            "goalieId": np.array(goalieId, dtype=np.int32),
+            "gameId": np.array(gameId, dtype=np.int32),
+            "eventType": self._encode("eventType", eventType),
+            "periodType": self._encode("periodType", periodType),
+            "x": np.array(x, dtype=np.float64).astype(np.float32),
+            "y": np.array(y, dtype=np.float64).astype(np.float32),
+        }
+        goalies, offsets = np.unique(columns["goalieId"], return_index=True)
+        offsets = np.append(offsets, len(rows)).astype(np.int64)
+
+        # the season is written next to the old copy and then swapped in
+        tmpDir = self._season_dir(season) + ".tmp"
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        os.makedirs(tmpDir)
+        for name, suffix, dtype in COLUMNS:
+            columns[name].astype(dtype).tofile(_column_file(tmpDir, name, suffix))
+        goalies.astype(np.int32).tofile(_column_file(tmpDir, "goalies", "i4"))
+        offsets.tofile(_column_file(tmpDir, "offsets", "i8"))
+        return tmpDir, len(rows), len(goalies)
+
+    def _remove_season(self, season):
+        # the season is removed from the meta first, so it is never listed while
+        # its files are being replaced
+        self.meta["seasons"].pop(str(season), None)
+        self._save_meta()
+        shutil.rmtree(self._season_dir(season), ignore_errors=True)
+
+    def update(self, dbfile, force=False):
+        """
+        Write every season that changed in the database since it was written, and
+        remove the seasons that are no longer in the database. Returns the seasons
+        that were written.
+        """
+        con = sqlite3.connect(f"file:{os.path.abspath(dbfile)}?mode=ro", uri=True)
+        try:
+            # a database written before the versions were kept is always read again
+            hasVersions = con.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='season_versions'"
+            ).fetchone()
+            versions = {}
+            if hasVersions:
+                versions = dict(con.execute("SELECT season, version FROM season_versions"))
+            seasons = [row[0] for row in con.execute("SELECT DISTINCT season FROM shots")]
+
+            for season in self.seasons():
+                if season not in seasons:
+                    self._remove_season(season)
+
+            written = []
+            for season in sorted(seasons):
+                info = self.meta["seasons"].get(str(season))
+                version = versions.get(season)
+                if not force and version is not None and info is not None \
+                        and info["version"] == version:
+                    continue
+
+                tmpDir, rows, goalies = self._write_season(con, season)
+                self._remove_season(season)
+                os.replace(tmpDir, self._season_dir(season))
+                self.meta["seasons"][str(season)] = {
+                    "version": version, "rows": rows, "goalies": goalies
+                }
+                self._save_meta()
+                written.append(season)
+        finally:
+            con.close()
+
+        return written
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Write the shots to a column store: ')
+    parser.add_argument(
+        '--db',
+        type=str,
+        help='Sqlite database created by NhlDB.py.',
+        default="nhl.db"
+    )
+    parser.add_argument(
+        '--dir',
+        type=str,
+        help='Directory of the column store.',
+        default="shots.columns"
+    )
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Write every season, even when it has not changed.'
+    )
+    args = parser.parse_args()
+
+    store = ColumnStore(args.dir)
+    written = store.update(args.db, args.force)
+    for season in written:
+        print(f"wrote {season}: {store.meta['seasons'][str(season)]['rows']} shots")
+    print(f"{len(written)} of {len(store.seasons())} seasons written")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Read access to the sqlite database for the viewer.
+
+Only the player list is read up front. The seasons and events of a goalie are
+read when they are needed, through the (goalieId, season) index, and the most
+recently used results are kept in a bounded cache. The glove/stick records are
+read from the goalie_season_sides aggregate that NhlDB.py maintains.
+
+The player list is also kept in a small snapshot file next to the database, so
+the viewer can show it before it opens the database (see PlayerSnapshot).
+
+The database can be used from several threads, each thread has its own
+connection until the database is closed. The data version tells when another connection (e.g. LiveTracker.py)
+wrote to the database, the cached results are stale from then on.
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Mapping that holds at most `size` entries, the least recently used entry is
+    dropped first.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, key, default=None):
+        if key not in self.entries:
+            return default
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ShotDatabase:
+
+    def __init__(self, dbfile="nhl.db", cacheSize=64):
+        self.dbfile = dbfile
+        self.connections = {}  # thread id: connection
+        self.lock = threading.Lock()
+        self.seasonCache = LRUCache(cacheSize)
+        self.eventCache = LRUCache(cacheSize)
+
+    @property
+    def conn(self):
+        """
+        Connection for the calling thread. The connections are kept by the id of the
+        thread rather than in a threading.local, the Python state of a QThreadPool
+        thread does not live longer than a single task.
+        """
+        ident = threading.get_ident()
+        with self.lock:
+            conn = self.connections.get(ident)
+            if conn is None:
+                # closed from the thread that closes the database
+                conn = sqlite3.connect(self.dbfile, check_same_thread=False)
+                self.connections[ident] = conn
+        return conn
+
+    def players(self, columns):
+        """
+        All players, with the selected columns
+        """
+        queryable = ", ".join(columns)
+        return self.conn.execute(f"SELECT {queryable} FROM players").fetchall()
+
+    def seasons(self, goalieId):
+        """
+        Seasons where the goalie was part of at least one event, in order.
+        """
+        with self.lock:
+            seasons = self.seasonCache.get(goalieId)
+        if seasons is None:
+            cur = self.conn.execute(
+                "SELECT DISTINCT season FROM shots WHERE goalieId = ? ORDER BY season",
+                (goalieId,)
+            )
+            seasons = [row[0] for row in cur.fetchall()]
+            with self.lock:
+                self.seasonCache.put(goalieId, seasons)
+        return seasons
+
+    def events(self, goalieId, season, columns):
+        """
+        Events for the goalie in the season, with the selected columns.
+        """
+        key = (goalieId, season, tuple(columns))
+        with self.lock:
+            events = self.eventCache.get(key)
+        if events is None:
+            queryable = ", ".join(columns)
+            cur = self.conn.execute(
+                f"SELECT {queryable} FROM shots WHERE goalieId = ? AND season = ?",
+                (goalieId, season)
+            )
+            events = cur.fetchall()
+            with self.lock:
+                self.eventCache.put(key, events)
+        return events
+
+    def data_version(self):
+        """
+        Number that changes every time another connection commits to the database
+        """
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def clear_cache(self):
+        with self.lock:
+            self.seasonCache.clear()
+            self.eventCache.clear()
+
+    def players_version(self):
+        """
+        Version of the players table, None for a database that does not keep it
+        (schema version 5 or older).
+        """
+        cur = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='table_versions'"
+        )
+        if cur.fetchone() is None:
+            return None
+        row = self.conn.execute(
+            "SELECT version FROM table_versions WHERE name = 'players'"
+        ).fetchone()
+        return row[0] if row else None
+
+    @property
+    def hasSides(self):
+        """
+        True when the database has the goalie_season_sides aggregate (schema
+        version 3 or later).
+        """
+        cur = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='goalie_season_sides'"
+        )
+        return cur.fetchone() is not None
+
+    def sides(self, goalieId, season):
+        """
+        Number of events with coordinates and the shots and goals to the left and
+        right of the goalie in the season: (events, leftShots, leftGoals,
+        rightShots, rightGoals), None when the goalie has no events with coordinates.
+        """
+        cur = self.conn.execute(
+            """
+            SELECT events, leftShots, leftGoals, rightShots, rightGoals
+            FROM goalie_season_sides WHERE goalieId = ? AND season = ?
+            """,
+            (goalieId, season)
+        )
+        return cur.fetchone()
+
+    def weak_side_gaps(self, season=None, minShots=0, limit=None):
+        """
+        Goalies ranked by the difference between their glove and stick save
+        percentage, largest first. Only goalie-seasons with at least minShots shots
+        to each side are ranked. Each row is (playerId, firstName, lastName, season,
+        gloveShots, gloveSavePercentage, stickShots, stickSavePercentage, gap).
+        """
+        query = """
+            SELECT playerId, firstName, lastName, season,
+                   gloveShots, gloveSave, stickShots, stickSave,
+                   ABS(gloveSave - stickSave) AS gap
+            FROM (
+                SELECT p.playerId, p.firstName, p.lastName, s.season,
+                       CASE WHEN p.shootsCatches = 'L' THEN s.leftShots ELSE s.rightShots END
+                           AS gloveShots,
+                       CASE WHEN p.shootsCatches = 'L' THEN s.rightShots ELSE s.leftShots END
+                           AS stickShots,
+                       CASE WHEN p.shootsCatches = 'L'
+                           THEN (s.leftShots - s.leftGoals) * 100.0 / s.leftShots
+                           ELSE (s.rightShots - s.rightGoals) * 100.0 / s.rightShots
+                       END AS gloveSave,
+                       CASE WHEN p.shootsCatches = 'L'
+                           THEN (s.rightShots - s.rightGoals) * 100.0 / s.rightShots
+                           ELSE (s.leftShots - s.leftGoals) * 100.0 / s.leftShots
+                       END AS stickSave
+                FROM goalie_season_sides s JOIN players p ON p.playerId = s.goalieId
+                WHERE s.leftShots >= MAX(?, 1) AND s.rightShots >= MAX(?, 1)
+                      AND (? IS NULL OR s.season = ?)
+            )
+            ORDER BY gap DESC
+        """
+        params = [minShots, minShots, season, season]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return self.conn.execute(query, params).fetchall()
+
+    def close(self):
+        with self.lock:
+            for conn in self.connections.values():
+                conn.close()
+            self.connections = {}
+
+
+def read_players(database, columns, knownVersion=None):
+    """
+    Version of the players table and its rows, the rows are None when the version
+    is knownVersion and the rows did not change.
+    """
+    version = database.players_version()
+    if version is not None and version == knownVersion:
+        return version, None
+    return version, database.players(columns)
+
+
+class PlayerSnapshot:
+    """
+    Player list of a database saved to a file (<database>.players.json). The
+    snapshot belongs to the database file and to a version of its players table,
+    it is only used while both are the same. Reading it does not open the database.
+    """
+
+    def __init__(self, dbfile, filename=None):
+        self.dbfile = dbfile
+        self.filename = filename or os.path.splitext(dbfile)[0] + ".players.json"
+
+    def _database(self):
+        # a database that was created again is a different file
+        return [os.path.abspath(self.dbfile), os.stat(self.dbfile).st_ino]
+
+    def load(self, columns):
+        """
+        Rows and version of the players in the snapshot, (None, None) when there is
+        no snapshot of the database with these columns.
+        """
+        try:
+            with open(self.filename) as snapshotFile:
+                snapshot = json.load(snapshotFile)
+            database = self._database()
+        except (OSError, ValueError):
+            return None, None
+
+        if snapshot.get("database") != database or snapshot.get("columns") != list(columns):
+            return None, None
+        return [tuple(row) for row in snapshot["rows"]], snapshot["version"]
+
+    def save(self, columns, rows, version):
+        """
+        Write the snapshot. Nothing is written without a version, the snapshot could
+        never be checked against the database.
+        """
+        if version is None:
+            return
+        try:
+            snapshot = {
+                "database": self._database(),
+                "version": version,
+                "columns": list(columns),
+                "rows": rows,
+            }
+            with open(self.filename + ".tmp", "w") as snapshotFile:
+                json.dump(snapshot, snapshotFile)
+            os.replace(self.filename + ".tmp", self.filename)
+        except OSError:
+            # the viewer works without a snapshot, e.g. in a read only directory
+            pass
@@ -1,3 +1,9 @@
+from time import perf_counter
+
+# start of the viewer for the time to the first paint, before the imports
+STARTED = perf_counter()
+
+import os
 import sys
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import (
@@ -5,17 +11,71 @@ from PyQt5.QtWidgets import (
     QWidget,
     QHBoxLayout,
     QVBoxLayout,
+    QTableView,
     QTableWidget,
     QTableWidgetItem,
-    QComboBox
+    QComboBox,
+    QCheckBox
 )
-from PyQt5.QtCore import Qt
-import sqlite3
-import pyqtgraph as pg
+from database import ShotDatabase, LRUCache, PlayerSnapshot, read_players
+from models import RowTableModel
+from workers import TaskRunner
+from search import SearchFilterModel
+# the instrumentation is shared with the scripts in ../hack
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "hack"))
+import instrument  # noqa: E402
+
+# pyqtgraph and numpy (through analytics) are most of the startup time, they are
+# imported when the first goalie is selected rather than before the first paint
+
+
+# time between the checks for changes to the database
+REFRESH_INTERVAL_MS = 5000
+
+
+def load_season(database, goalieId, season, columns, showRecords, shootsCatches):
+    """
+    Read the events of the goalie in the season, and find the shot coordinates and
+    the glove/stick records. This does not touch any widgets, so it runs off of the
+    GUI thread. The records are None when they should not be displayed.
+    """
+    from analytics import (
+        SideCounts, columns_from_rows, has_coordinates, side_counts, side_records
+    )
+
+    with instrument.stage("sqlite.events"):
+        events = database.events(goalieId, season, columns)
+    instrument.count("events", len(events))
+
+    with instrument.stage("analytics.columns"):
+        eventType, x, y = columns_from_rows(events, 0, len(columns)-2, len(columns)-1)
+        valid = has_coordinates(x, y)
+        xData = x[valid]
+        yData = y[valid]
+
+    if not showRecords:
+        return events, xData, yData, None, None
+
+    # the records come from the aggregate kept by NhlDB.py, they are counted from
+    # the events for a database that was written before the aggregate existed
+    with instrument.stage("analytics.records"):
+        if database.hasSides:
+            row = database.sides(goalieId, season)
+            if row is None or not row[0]:
+                return events, xData, yData, None, None
+            counts = SideCounts(*([value] for value in row[1:]))
+        else:
+            if not valid.any():
+                return events, xData, yData, None, None
+            counts = side_counts(eventType, x, y)
+
+        records, weakKey = side_records(counts, shootsCatches)
+    return events, xData, yData, records, weakKey
 
 
 class MainWindow(QtWidgets.QMainWindow):
 
+    @instrument.timed("viewer.init")
     def __init__(self):
         super().__init__()
 
@@ -25,9 +85,28 @@ class MainWindow(QtWidgets.QMainWindow):
         self.query.setPlaceholderText("Search")
         self.query.textChanged.connect(self.search)
 
-        # select * from the table containing all players where the position is goalie
-        conn = sqlite3.connect("nhl.db")
-        curr = conn.cursor()
+        # only the players are read at startup, the seasons and events of a goalie
+        # are read when the goalie is selected
+        self.database = ShotDatabase("nhl.db")
+        self.playerSnapshot = PlayerSnapshot("nhl.db")
+
+        # the database is checked for changes (e.g. the games followed by
+        # LiveTracker.py) and the displayed season is read again when it changed.
+        # The checks start after the first paint, see finish_startup
+        self.dataVersion = None
+        self.refreshTimer = QtCore.QTimer(self)
+        self.refreshTimer.setInterval(REFRESH_INTERVAL_MS)
+        self.refreshTimer.timeout.connect(self.check_database)
+
+        # database reads and statistics run in the background, a new selection
+        # makes the work for the previous selection stale. The threads of the pool
+        # are kept while the window is open, each has its own database connection
+        self.pool = QtCore.QThreadPool(self)
+        self.pool.setMaxThreadCount(3)
+        self.pool.setExpiryTimeout(-1)
+        self.seasonRunner = TaskRunner(self.pool, parent=self)
+        self.eventRunner = TaskRunner(self.pool, parent=self)
+        self.playerRunner = TaskRunner(self.pool, parent=self)
 
         # rows that will be a part of the query and ultimately the display for
         # the player table
@@ -37,26 +116,25 @@ class MainWindow(QtWidgets.QMainWindow):
             "lastName": "Last Name",
             "shootsCatches": "Catches"
         }
-        queryable = ", ".join([x for x in self.playerSelection.keys()])
-
-        curr.execute(f"SELECT {queryable} FROM players")
-        rows = curr.fetchall()
-        data = rows
-
-        self.playerTable = QTableWidget()
-        self.playerTable.setRowCount(len(rows))
-        self.playerTable.setColumnCount(len(self.playerSelection))
-        self.playerTable.setHorizontalHeaderLabels(list(self.playerSelection.values()))
-
-        self.rowWidgets = []
-        
-        # This seems like a bad way of doing things but let's brute force
-        # fill the table with all of the Goalie information
-        for r in range(len(rows)):
-            for c in range(len(self.playerSelection)):
-                item = QTableWidgetItem(str(rows[r][c]))
-                self.rowWidgets.append(item)
-                self.playerTable.setItem(r, c, item)
+        # The players of the snapshot are shown without opening the database, they
+        # are checked against the database after the first paint. Without a
+        # snapshot the players are read from the database.
+        columns = list(self.playerSelection.keys())
+        with instrument.stage("snapshot.players"):
+            rows, self.playersVersion = self.playerSnapshot.load(columns)
+        if rows is None:
+            with instrument.stage("sqlite.players"):
+                self.playersVersion, rows = read_players(self.database, columns)
+            self.playerSnapshot.save(columns, rows, self.playersVersion)
+
+        # The model only formats the cells that are visible, the filter model shows
+        # the players that match the search
+        with instrument.stage("qt.players"):
+            self.playerModel = RowTableModel(self.playerSelection.values(), rows)
+            self.playerFilter = SearchFilterModel()
+            self.playerFilter.setSourceModel(self.playerModel)
+            self.playerTable = QTableView()
+            self.playerTable.setModel(self.playerFilter)
 
         # rows that will be a part of the query and ultimarely the display for
         # the event table
@@ -70,28 +148,12 @@ class MainWindow(QtWidgets.QMainWindow):
             "xCoordinate": "X Coodinate",
             "yCoordinate": "Y Coordinate"
         }
-        queryable = ', '.join([x for x in self.eventSelection.keys()])
-                
-        # create a mapping of goalies to the events that they were a part of
-        self.goalieEvents = {row[0]: {} for row in rows}
-
-        # get all events
-        curr.execute(f"SELECT {queryable} FROM shots")
-        events = curr.fetchall()
-
-        # separate all events by the goalie that was part of the event
-        for event in events:
-            if event[3] in self.goalieEvents:
-                # separate by season
-                if event[1] not in self.goalieEvents[event[3]]:
-                    self.goalieEvents[event[3]][event[1]] = []
-                self.goalieEvents[event[3]][event[1]].append(event)
 
 
         # The event table will only show data when a player has been selected 
-        self.eventTable = QTableWidget()
-        self.eventTable.setColumnCount(len(self.eventSelection))
-        self.eventTable.setHorizontalHeaderLabels(list(self.eventSelection.values()))
+        self.eventModel = RowTableModel(self.eventSelection.values())
+        self.eventTable = QTableView()
+        self.eventTable.setModel(self.eventModel)
 
         # The evaluation table will only show data when a season is selected
         self.evalTable = QTableWidget()
@@ -107,14 +169,28 @@ class MainWindow(QtWidgets.QMainWindow):
         # controls the season number for the display 
         self.seasonComboBox = QComboBox()
 
-        # display to show where goals/shots have been scored
-        self.canvas = pg.plot()
+        # display to show where goals/shots have been scored, either every shot as a
+        # marker or the number of shots in each part of the rink as a single image
+        self.heatmapCheckBox = QCheckBox("Heatmap")
+        self.heatmapCheckBox.toggled.connect(self.draw_shots)
+
+        # the canvas is created when the first goalie is selected, see create_canvas
+        self.canvas = None
+        self.canvasPlaceholder = QWidget()
+        self.canvasPlaceholder.setSizePolicy(
+            QtWidgets.QSizePolicy.Expanding, QtWidgets.QSizePolicy.Expanding
+        )
         self.scatter = None
-        self.canvas.showGrid(x=True, y=True)
-        # A hockey arena is 200 x 805 ft. The coordinates are [-100, 100] and [-42.5, 42.5]
-        # lets provide a slight buffer here.
-        self.canvas.setXRange(-105, 105)
-        self.canvas.setYRange(-45, 45)
+        self.heatmap = None
+
+        # shots of the season that is displayed, and the binned shots of recently
+        # displayed seasons
+        self.shotKey = None
+        self.shotData = None
+        self.densityCache = LRUCache(64)
+
+        # time of the first paint, see paintEvent
+        self.firstPaint = None
         
         # main Container
         mainContainer = QWidget()
@@ -129,30 +205,113 @@ class MainWindow(QtWidgets.QMainWindow):
         leftContainerLayout.addWidget(self.playerTable)
 
         rightContainer = QWidget()
-        rightContainerLayout = QVBoxLayout()
-        rightContainer.setLayout(rightContainerLayout)
+        self.rightContainerLayout = QVBoxLayout()
+        rightContainer.setLayout(self.rightContainerLayout)
         # Fill in the widget information for the display
-        rightContainerLayout.addWidget(self.seasonComboBox)
-        rightContainerLayout.addWidget(self.eventTable)
-        rightContainerLayout.addWidget(self.canvas)
-        rightContainerLayout.addWidget(self.evalTable)
+        self.rightContainerLayout.addWidget(self.seasonComboBox)
+        self.rightContainerLayout.addWidget(self.heatmapCheckBox)
+        self.rightContainerLayout.addWidget(self.eventTable)
+        self.rightContainerLayout.addWidget(self.canvasPlaceholder)
+        self.rightContainerLayout.addWidget(self.evalTable)
         
         # Add the left and right components to the main container
         mainContainerLayout.addWidget(leftContainer)
         mainContainerLayout.addWidget(rightContainer)
 
         # setup the signals that are needed for changes to the table selection
-        self.playerTable.itemSelectionChanged.connect(self.table_selection_changed)
+        self.playerTable.selectionModel().selectionChanged.connect(self.table_selection_changed)
         self.seasonComboBox.currentIndexChanged.connect(self.combo_box_changed)
         
         # Set the main widget 
         self.setCentralWidget(mainContainer)
 
+    def closeEvent(self, event):
+        """
+        Stop the background work and close the database connections
+        """
+        self.refreshTimer.stop()
+        for runner in (self.seasonRunner, self.eventRunner, self.playerRunner):
+            runner.cancel()
+        self.pool.waitForDone()
+        self.database.close()
+        super().closeEvent(event)
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if self.firstPaint is None:
+            self.firstPaint = perf_counter()
+            instrument.record("viewer.first paint", STARTED, self.firstPaint)
+            # everything that can wait runs once the window is on screen
+            QtCore.QTimer.singleShot(0, self.finish_startup)
+
+    def finish_startup(self):
+        """
+        Start the checks for changes to the database, and check the players of the
+        snapshot against the database.
+        """
+        self.dataVersion = self.database.data_version()
+        self.refreshTimer.start()
+
+        self.playerRunner.submit(
+            self.players_loaded,
+            read_players,
+            self.database,
+            list(self.playerSelection.keys()),
+            self.playersVersion,
+            onError=self.load_failed
+        )
+
+    def players_loaded(self, result):
+        """
+        Show the players read from the database when the snapshot was out of date
+        """
+        version, rows = result
+        if rows is None:
+            return
+
+        columns = list(self.playerSelection.keys())
+        self.playersVersion = version
+        self.playerSnapshot.save(columns, rows, version)
+        if rows == self.playerModel.rows:
+            return
+
+        with instrument.stage("qt.players"):
+            self.playerModel.set_rows(rows)
+            self.playerFilter.rebuild()
+            self.playerFilter.set_query(self.query.text())
+
+    def create_canvas(self):
+        """
+        Create the canvas for the shots in place of the placeholder, the first time
+        it is needed.
+        """
+        if self.canvas is not None:
+            return
+
+        with instrument.stage("plot.canvas"):
+            import pyqtgraph as pg
+
+            self.canvas = pg.plot()
+            self.heatmap = pg.ImageItem()
+            self.heatmap.setLookupTable(pg.colormap.get("viridis").getLookupTable())
+            self.canvas.addItem(self.heatmap)
+
+            self.canvas.showGrid(x=True, y=True)
+            # A hockey arena is 200 x 805 ft. The coordinates are [-100, 100] and [-42.5, 42.5]
+            # lets provide a slight buffer here.
+            self.canvas.setXRange(-105, 105)
+            self.canvas.setYRange(-45, 45)
+
+            self.rightContainerLayout.replaceWidget(self.canvasPlaceholder, self.canvas)
+            self.canvasPlaceholder.deleteLater()
+            self.canvasPlaceholder = None
+
     def _get_player_table_rows(self):
         rows = set()
-        items = self.playerTable.selectedItems()
-        for item in items:
-            rows.add(item.row())
+        indexes = self.playerTable.selectionModel().selectedIndexes()
+        for index in indexes:
+            # rows of the player model, the table shows the filtered rows
+            rows.add(self.playerFilter.mapToSource(index).row())
         rows = list(rows)
         return rows
         
@@ -161,166 +320,201 @@ class MainWindow(QtWidgets.QMainWindow):
         When the table has a selected item then it will change the display of the right
         side of the display. If more than one item is selected then nothing will be displayed.
         """
+        # anything that is still loading for the previous selection is stale
+        self.seasonRunner.cancel()
+        self.eventRunner.cancel()
+
         # clear out everything in the table.
         # if 0 items or more than 1 item is selected in the player table, then
         # nothing should be displayed anyways. 
-        while self.eventTable.rowCount() > 0:
-            self.eventTable.removeRow(0)
+        self.eventModel.clear()
 
         # clear the table containing the save percentage info
-        while self.evalTable.rowCount() > 0:
-            self.evalTable.removeRow(0)
+        self.evalTable.setRowCount(0)
             
         # clear out the combo box too
         self.seasonComboBox.clear()
 
         # clear the current canvas
-        if self.scatter:
-            self.scatter.clear()
+        self.clear_canvas()
         
         rows = self._get_player_table_rows()
             
         if len(rows) == 1:
-            # set the combo box
-            playerId = self.playerTable.item(rows[0], 0).text()
+            playerId = self.playerModel.row(rows[0])[0]
             self.activePlayerId = playerId
 
-            if playerId in self.goalieEvents:
-                values = []
-                for value in self.goalieEvents[playerId]:
-                    values.append(f"{value[0:4]} - {value[4:]}")
-                self.seasonComboBox.addItems(values)
-                self.seasonComboBox.setCurrentIndex(0)
+            # the seasons are read in the background, the combo box is set when
+            # they arrive
+            self.seasonRunner.submit(
+                self.seasons_loaded, self.database.seasons, playerId, onError=self.load_failed
+            )
+            # while the seasons are read
+            self.create_canvas()
+
+    def seasons_loaded(self, seasons):
+        """
+        Fill the combo box with the seasons of the selected goalie
+        """
+        if seasons:
+            values = []
+            for value in seasons:
+                value = str(value)
+                values.append(f"{value[0:4]} - {value[4:]}")
+            self.seasonComboBox.addItems(values)
+            self.seasonComboBox.setCurrentIndex(0)
 
-    
     def combo_box_changed(self, index):
         """
         Combo box index changed, update the data that is stored in the event table
         """
-        while self.eventTable.rowCount() > 0:
-            self.eventTable.removeRow(0)
-
-        while self.evalTable.rowCount() > 0:
-            self.evalTable.removeRow(0)
+        self.eventRunner.cancel()
+        self.eventModel.clear()
+        self.evalTable.setRowCount(0)
 
         # clear the canvas so that we can redraw later
-        if self.scatter:
-            self.scatter.clear()
+        self.clear_canvas()
             
         season = self.seasonComboBox.itemText(index)
         season = season.replace(" - ", "")
+        season = int(season) if season else None
 
-        xData = []
-        yData = []
-        records = {
-            "left": {
-                "side": "",
-                "shots": 0,
-                "goals": 0,
-                "savePercentage": 0.0
-            },
-            "right": {
-                "side": "",
-                "shots": 0,
-                "goals": 0,
-                "savePercentage": 0.0
-            }
-        }
-        setRecords = False
-                        
-        if self.activePlayerId is not None:
-            if self.activePlayerId in self.goalieEvents and \
-               season in self.goalieEvents[self.activePlayerId]:
-                events = self.goalieEvents[self.activePlayerId][season]
-                
-                self.eventTable.setRowCount(len(events))
-                
-                for r in range(len(events)):
-                    for c in range(len(self.eventSelection)):
-                        item = QTableWidgetItem(str(events[r][c]))
-                        self.eventTable.setItem(r, c, item)
-
-                    if events[r][len(self.eventSelection)-2] == '' or \
-                       events[r][len(self.eventSelection)-1] == '':
-                        continue
-                    
-                    xcoord = float(events[r][len(self.eventSelection)-2])
-                    xData.append(xcoord)
-                    ycoord = float(events[r][len(self.eventSelection)-1]) 
-                    yData.append(ycoord)
-                    
-                    if events[r][0] in ("Goal", "Blocked Shot", "Shot"):
-                        shotToSide = "right"  # Q2 or Q4 - this is a shot to the goalies left
-                        if (xcoord >= 0 and ycoord >= 0) or (xcoord < 0 and ycoord < 0):
-                            # Q1 or Q3 - this is a shot to the goalies right
-                            shotToSide = "left"
-                        if shotToSide in records:
-                            if events[r][0] == "Goal":
-                                records[shotToSide]["goals"] += 1
-                            records[shotToSide]["shots"] += 1
-
-                    setRecords = True
-                    
-
-                # Columns = side (glove vs stick), shots, goals, save percentage
-                # The side will indicate the rows (should always be 2)
-                rows = self._get_player_table_rows()
-                if len(rows) == 1 and setRecords:
-                    shootsCatches = self.playerTable.item(rows[0], len(self.playerSelection)-1).text()
-
-                    if shootsCatches == "L":  # more than likely right handed
-                        records["left"]["side"] = "glove"
-                        records["right"]["side"] = "stick"
-                    else:
-                        records["left"]["side"] = "stick"
-                        records["right"]["side"] = "glove"
-
-                    weakKey = None
-                    weakPercent = 100
-                    for key, value in records.items():
-                        savePercent = float(value["shots"] - value["goals"]) / float(value["shots"]) * 100.0
-                        records[key]["savePercentage"] = savePercent
-
-                        if savePercent < weakPercent:
-                            weakPercent = savePercent
-                            weakKey = key
-                        
-                    # update the eval table
-                    self.evalTable.setRowCount(len(records))
-                    keys = list(records.keys())
-                    for r in range(len(records)):
-                        shouldHighlight = keys[r] == weakKey
-                        
-                        innerKeys = list(records[keys[r]].keys())
-                        for c in range(len(records[keys[r]])):
-                            item = QTableWidgetItem(str(records[keys[r]][innerKeys[c]]))
-
-                            # highlight the cells where the key is the weaker of the sides
-                            if shouldHighlight:
-                                item.setBackground(QtGui.QColor(255, 255, 0))
-                            
-                            self.evalTable.setItem(r, c, item)
-                        
+        if self.activePlayerId is None or season is None:
+            return
+
+        self.submit_season(season)
+
+    def submit_season(self, season):
+        """
+        Read the events of the season of the active goalie in the background, the
+        display is updated when they arrive.
+        """
+        # The glove/stick records are only displayed for a single selected goalie
+        shootsCatches = None
+        rows = self._get_player_table_rows()
+        if len(rows) == 1:
+            shootsCatches = self.playerModel.row(rows[0])[len(self.playerSelection)-1]
+
+        # the events are read and the records are calculated in the background
+        self.eventRunner.submit(
+            self.season_loaded,
+            load_season,
+            self.database,
+            self.activePlayerId,
+            season,
+            list(self.eventSelection.keys()),
+            len(rows) == 1,
+            shootsCatches,
+            onError=self.load_failed
+        )
+        self.shotKey = (self.activePlayerId, season)
+
+    def season_loaded(self, result):
+        """
+        Display the events and records of the selected season
+        """
+        events, xData, yData, records, weakKey = result
+
+        with instrument.stage("qt.events"):
+            self.eventModel.set_rows(events)
+
+        # Columns = side (glove vs stick), shots, goals, save percentage
+        # The side will indicate the rows (should always be 2)
+        if records is not None:
+            with instrument.stage("qt.records"):
+                # update the eval table
+                self.evalTable.setRowCount(len(records))
+                keys = list(records.keys())
+                for r in range(len(records)):
+                    shouldHighlight = keys[r] == weakKey
+
+                    innerKeys = list(records[keys[r]].keys())
+                    for c in range(len(records[keys[r]])):
+                        item = QTableWidgetItem(str(records[keys[r]][innerKeys[c]]))
+
+                        # highlight the cells where the key is the weaker of the sides
+                        if shouldHighlight:
+                            item.setBackground(QtGui.QColor(255, 255, 0))
+
+                        self.evalTable.setItem(r, c, item)
+
+        self.shotData = (xData, yData)
+        self.draw_shots()
+
+    def clear_canvas(self):
+        self.shotKey = None
+        self.shotData = None
+        if self.scatter:
+            self.scatter.clear()
+        if self.heatmap:
+            self.heatmap.clear()
+
+    def draw_shots(self):
+        """
+        Draw the shots of the season as markers, or as a heatmap when it is selected
+        """
+        if self.scatter:
+            self.scatter.clear()
+        if self.heatmap:
+            self.heatmap.clear()
+
+        if self.shotData is None:
+            return
+        xData, yData = self.shotData
+        self.create_canvas()
+
+        if self.heatmapCheckBox.isChecked():
+            from analytics import RINK_X, RINK_Y, shot_density
+
+            density = self.densityCache.get(self.shotKey)
+            if density is None:
+                with instrument.stage("analytics.density"):
+                    density = shot_density(xData, yData)
+                self.densityCache.put(self.shotKey, density)
+
+            with instrument.stage("plot.heatmap"):
+                self.heatmap.setImage(density, levels=(0, max(density.max(), 1)))
+                self.heatmap.setRect(QtCore.QRectF(
+                    RINK_X[0], RINK_Y[0], RINK_X[1] - RINK_X[0], RINK_Y[1] - RINK_Y[0]
+                ))
+        elif self.scatter:
             # pen=None disables line drawing
-            self.scatter = self.canvas.plot(xData, yData, pen=None, symbol='+')
+            with instrument.stage("plot.scatter"):
+                self.scatter.setData(xData, yData, pen=None, symbol='+')
+        else:
+            with instrument.stage("plot.scatter"):
+                self.scatter = self.canvas.plot(xData, yData, pen=None, symbol='+')
+
+    def check_database(self):
+        """
+        Read the displayed season again when the database changed. The display is
+        kept until the new data arrives.
+        """
+        dataVersion = self.database.data_version()
+        if dataVersion == self.dataVersion:
+            return
+        self.dataVersion = dataVersion
+
+        self.database.clear_cache()
+        self.densityCache.clear()
+        if self.shotKey is not None:
+            self.submit_season(self.shotKey[1])
+
+    def load_failed(self, error):
+        print(f"Failed to load data: {error}")
 
-        
     def search(self, s):
         """
         Display only the rows of data where the user entered text is found. When
         empty all rows in the table should appear.
         """
-        if s:
-            for i in range(self.playerTable.rowCount()):
-                self.playerTable.hideRow(i)
-        
-        items = self.playerTable.findItems(s, Qt.MatchContains)
-        if items:
-            for item in items:
-                self.playerTable.showRow(item.row())
+        with instrument.stage("search"):
+            self.playerFilter.set_query(s)
 
 
 if __name__ == '__main__':
+    # NHL_INSTRUMENT, NHL_PROFILE and NHL_TRACE enable the instrumentation
+    instrument.setup()
     app = QtWidgets.QApplication(sys.argv)
     window = MainWindow()
     window.resize(800, 800)
@@ -0,0 +1,56 @@
+"""
+Table models for the viewer.
+
+The models hold a reference to the rows returned by the database and only
+format the cells that the view asks for, so the cost of showing a table depends
+on the rows that are visible rather than the number of rows in the table.
+"""
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+
+class RowTableModel(QAbstractTableModel):
+    """
+    Read only model over a sequence of rows, each row is a sequence of values
+    in the same order as the headers.
+    """
+
+    def __init__(self, headers, rows=None, parent=None):
+        super().__init__(parent)
+        self.headers = list(headers)
+        self.rows = rows if rows is not None else []
+
+    def set_rows(self, rows):
+        """
+        Replace the rows of the model. Nothing is copied or formatted, the view is
+        told to reset and will request the cells it needs.
+        """
+        self.beginResetModel()
+        self.rows = rows if rows is not None else []
+        self.endResetModel()
+
+    def clear(self):
+        self.set_rows([])
+
+    def row(self, index):
+        return self.rows[index]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+
+        value = self.rows[index.row()][index.column()]
+        return "" if value is None else str(value)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return str(section + 1)
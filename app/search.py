@@ -0,0 +1,176 @@
+"""
+Search over the rows of a table.
+
+The index is built once over the text of every cell. Each n-gram (up to
+GRAM_SIZE characters) of a cell points to the rows that contain it, so a short
+query is a single lookup and a longer query only checks the rows that contain
+every one of its n-grams. When the query grows (each key press while typing)
+the rows that matched the previous query are candidates too, whichever set of
+candidates is the smallest is checked. The index is built on the first search.
+
+The filter model shows the rows that match without touching the source model or
+hiding rows in the view.
+"""
+from collections import defaultdict
+from PyQt5.QtCore import QAbstractProxyModel, QModelIndex, Qt
+
+
+GRAM_SIZE = 3
+
+
+def _cell_text(value):
+    return "" if value is None else str(value).lower()
+
+
+class SearchIndex:
+    """
+    Case insensitive substring search over the cells of the rows. A row matches
+    when any one of its cells contains the query.
+    """
+
+    def __init__(self, rows=()):
+        self.build(rows)
+
+    def build(self, rows):
+        self.rows = rows
+        self.cells = None
+        self.grams = None
+        self.lastQuery = ""
+        self.lastMatches = None
+
+    def _index(self):
+        self.cells = [tuple(_cell_text(value) for value in row) for row in self.rows]
+        self.grams = defaultdict(set)
+        for rowIndex, cells in enumerate(self.cells):
+            rowGrams = {
+                text[start:start + size]
+                for text in cells
+                for size in range(1, GRAM_SIZE + 1)
+                for start in range(len(text) - size + 1)
+            }
+            for gram in rowGrams:
+                self.grams[gram].add(rowIndex)
+
+    def _matches(self, rowIndex, query):
+        return any(query in text for text in self.cells[rowIndex])
+
+    def search(self, query):
+        """
+        Rows that contain the query, None when the query is empty (every row).
+        """
+        query = query.lower()
+        if query and self.grams is None:
+            self._index()
+
+        if not query:
+            matches = None
+        elif len(query) <= GRAM_SIZE:
+            matches = set(self.grams.get(query, ()))
+        else:
+            candidates = [
+                self.grams.get(query[start:start + GRAM_SIZE], set())
+                for start in range(len(query) - GRAM_SIZE + 1)
+            ]
+            if self.lastMatches is not None and self.lastQuery in query:
+                # the query grew, only rows that matched before can match now
+                candidates.append(self.lastMatches)
+            candidates.sort(key=len)
+            matches = {
+                i for i in candidates[0].intersection(*candidates[1:])
+                if self._matches(i, query)
+            }
+
+        self.lastQuery = query
+        self.lastMatches = matches
+        return matches
+
+
+class SearchFilterModel(QAbstractProxyModel):
+    """
+    Proxy model that only shows the rows of a flat source model that match the
+    search. The shown rows are a list of source rows, so a new search costs the
+    number of matches rather than a call for every row of the source model. The
+    index is built from the rows of the source model, call rebuild when they
+    change.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.searchIndex = SearchIndex()
+        self.matches = None
+        self.visible = []
+        self.positions = None
+
+    def setSourceModel(self, model):
+        super().setSourceModel(model)
+        self.rebuild()
+
+    def rebuild(self):
+        self.beginResetModel()
+        model = self.sourceModel()
+        self.searchIndex.build(model.rows if model is not None else ())
+        self.matches = None
+        self._show_matches()
+        self.endResetModel()
+
+    def _show_matches(self):
+        if self.matches is None:
+            model = self.sourceModel()
+            self.visible = range(model.rowCount() if model is not None else 0)
+        else:
+            self.visible = sorted(self.matches)
+        # the position of each source row is only needed to map the selection
+        self.positions = None
+
+    def set_query(self, query):
+        matches = self.searchIndex.search(query)
+        if matches == self.matches:
+            return
+
+        # the selected rows stay selected while they match
+        self.layoutAboutToBeChanged.emit()
+        persistent = self.persistentIndexList()
+        sources = [self.mapToSource(index) for index in persistent]
+
+        self.matches = matches
+        self._show_matches()
+
+        self.changePersistentIndexList(
+            persistent, [self.mapFromSource(index) for index in sources]
+        )
+        self.layoutChanged.emit()
+
+    def mapToSource(self, proxyIndex):
+        if not proxyIndex.isValid() or proxyIndex.row() >= len(self.visible):
+            return QModelIndex()
+        return self.sourceModel().index(self.visible[proxyIndex.row()], proxyIndex.column())
+
+    def mapFromSource(self, sourceIndex):
+        if not sourceIndex.isValid():
+            return QModelIndex()
+        if self.positions is None:
+            self.positions = {row: i for i, row in enumerate(self.visible)}
+        row = self.positions.get(sourceIndex.row())
+        if row is None:
+            return QModelIndex()
+        return self.index(row, sourceIndex.column())
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not self.hasIndex(row, column, parent):
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=QModelIndex()):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.visible)
+
+    def columnCount(self, parent=QModelIndex()):
+        model = self.sourceModel()
+        return 0 if parent.isValid() or model is None else model.columnCount()
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Vertical and 0 <= section < len(self.visible):
+            section = self.visible[section]
+        return self.sourceModel().headerData(section, orientation, role)
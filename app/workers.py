@@ -0,0 +1,100 @@
+"""
+Background work for the viewer.
+
+Database reads and the statistics are run in a thread pool so that the window
+keeps responding while they run. Each TaskRunner handles one kind of request,
+and a new request makes every earlier request of that runner stale: requests
+that have not started are removed from the pool, and results of requests that
+were already running are dropped rather than delivered.
+"""
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class TaskSignals(QObject):
+    """
+    Signals of a task. The object is created on the GUI thread, so the signals
+    emitted from the worker thread are delivered on the GUI thread.
+    """
+    finished = pyqtSignal(int, object)
+    failed = pyqtSignal(int, str)
+    done = pyqtSignal()
+
+
+class Task(QRunnable):
+
+    def __init__(self, generation, function, *args):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.generation = generation
+        self.function = function
+        self.args = args
+        self.cancelled = False
+        self.signals = TaskSignals()
+
+    def run(self):
+        try:
+            if self.cancelled:
+                return
+
+            try:
+                result = self.function(*self.args)
+            except Exception as e:
+                if not self.cancelled:
+                    self.signals.failed.emit(self.generation, str(e))
+                return
+
+            if not self.cancelled:
+                self.signals.finished.emit(self.generation, result)
+        finally:
+            self.signals.done.emit()
+
+
+class TaskRunner(QObject):
+
+    def __init__(self, pool=None, parent=None):
+        super().__init__(parent)
+        self.pool = pool or QThreadPool.globalInstance()
+        self.generation = 0
+        self.tasks = []
+
+    def submit(self, callback, function, *args, onError=None):
+        """
+        Run function(*args) in the pool, callback(result) is called on the GUI thread
+        when it finishes unless another request was submitted in the meantime.
+        """
+        self.cancel()
+
+        task = Task(self.generation, function, *args)
+        task.signals.finished.connect(
+            lambda generation, result: self._deliver(generation, callback, result)
+        )
+        if onError is not None:
+            task.signals.failed.connect(
+                lambda generation, error: self._deliver(generation, onError, error)
+            )
+
+        # keep a reference until the task is done, the pool does not own it
+        self.tasks.append(task)
+        task.signals.done.connect(lambda: self._forget(task))
+
+        self.pool.start(task)
+        return self.generation
+
+    def cancel(self):
+        """
+        Make every request submitted so far stale.
+        """
+        self.generation += 1
+        for task in self.tasks:
+            task.cancelled = True
+            # the task is removed when it has not started yet
+            if self.pool.tryTake(task):
+                self._forget(task)
+
+    def _forget(self, task):
+        if task in self.tasks:
+            self.tasks.remove(task)
+
+    def _deliver(self, generation, callback, result):
+        if generation == self.generation:
+            callback(result)
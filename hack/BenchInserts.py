@@ -0,0 +1,133 @@
+"""
+Benchmark of the rows per second written to the shots table.
+
+The original approach (one f-string INSERT per row) is compared with the
+prepared executemany batches used by NhlDB.py, with and without the bulk load
+settings. Each scenario writes to a fresh database in a temporary directory.
+
+    python BenchInserts.py --rows 200000
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+from time import perf_counter
+from NhlDB import Event, open_database, insert_events
+
+
+def make_events(rows, seed=0):
+    """
+    Synthetic events with the same shape as the ones read from the game data.
+    """
+    rng = random.Random(seed)
+    events = []
+    for i in range(rows):
+        events.append(Event(
+            eventType=rng.choice(["Shot", "Goal", "Blocked Shot", "Missed Shot"]),
+            season=20212022,
+            gameId=2021020001 + i // 60,
+            gameType="R",
+            goalieId=8470000 + rng.randrange(100),
+            eventId=i % 300,
+            period=rng.randrange(1, 4),
+            periodType="REGULAR",
+            periodTime="{:02d}:{:02d}".format(rng.randrange(20), rng.randrange(60)),
+            dateTime="2021-10-12T23:00:00Z",
+            xCoordinate=float(rng.randrange(-99, 100)),
+            yCoordinate=float(rng.randrange(-42, 43))
+        ))
+    return events
+
+
+def legacy_open_database(dbfile):
+    """
+    The original untyped table.
+    """
+    con = sqlite3.connect(dbfile)
+    con.execute("CREATE TABLE shots(eventType, season, gameId, gameType, goalieId, period, periodType, periodTime, dateTime, xCoordinate, yCoordinate)")
+    return con
+
+
+def legacy_insert_events(cur, events):
+    """
+    The original insert, one statement built and parsed for every row.
+    """
+    for event in events:
+        if event.xCoordinate is None or event.yCoordinate is None:
+            xcoord = ""
+            ycoord = ""
+        else:
+            xcoord = event.xCoordinate
+            ycoord = event.yCoordinate
+
+        cur.execute(f"INSERT INTO shots VALUES (\"{event.eventType}\", \"{event.season}\", \"{event.gameId}\", \"{event.gameType}\", \"{event.goalieId}\", \"{event.period}\", \"{event.periodType}\", \"{event.periodTime}\", \"{event.dateTime}\", \"{xcoord}\", \"{ycoord}\")")
+
+
+def legacy_executemany_events(cur, events):
+    """
+    A prepared executemany into the original table, this isolates the cost of
+    building and parsing a statement per row from the cost of the typed schema
+    and its indexes.
+    """
+    cur.executemany(
+        "INSERT INTO shots VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (event[:5] + event[6:] for event in events)
+    )
+
+
+SCENARIOS = {
+    "execute (original)": (legacy_open_database, legacy_insert_events, {}),
+    "executemany (original table)": (legacy_open_database, legacy_executemany_events, {}),
+    "executemany": (open_database, insert_events, {}),
+    "executemany + bulk settings": (
+        open_database, insert_events, {"wal": True, "synchronous": "NORMAL", "cacheSize": 64}
+    ),
+}
+
+
+def run(rows=100000, batch=50000):
+    """
+    Rows per second for each scenario. The events are committed every `batch` rows
+    the same way NhlDB.py commits them.
+    """
+    events = make_events(rows)
+    results = {}
+
+    for name, (connect, insert, settings) in SCENARIOS.items():
+        with tempfile.TemporaryDirectory() as tmpDir:
+            con = connect(os.path.join(tmpDir, "bench.db"), **settings)
+            cur = con.cursor()
+
+            start = perf_counter()
+            for i in range(0, len(events), batch):
+                insert(cur, events[i:i + batch])
+                con.commit()
+            elapsed = perf_counter() - start
+
+            con.close()
+
+        results[name] = {"rows": rows, "seconds": elapsed, "rowsPerSecond": rows / elapsed}
+
+    return results
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Benchmark inserts into the shots table: ')
+    parser.add_argument('--rows', type=int, help='Number of rows to insert.', default=100000)
+    parser.add_argument('--batch', type=int, help='Rows per commit.', default=50000)
+    args = parser.parse_args()
+
+    results = run(args.rows, args.batch)
+    baseline = results["execute (original)"]["rowsPerSecond"]
+    for name, result in results.items():
+        print("{:<30}{:>12.0f} rows/s{:>8.1f}x".format(
+            name, result["rowsPerSecond"], result["rowsPerSecond"] / baseline
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark of the time to parse a game and extract its goalies and events.
+
+The json module (the original decoder) is compared with parse_game from
+GameStorage.py, which uses orjson when it is installed. The games are read from a
+data directory in any of the storage formats, or built by MockNhlServer.py when
+the directory does not exist. Reading and decompressing the files is not timed,
+and both decoders must produce the same goalies and events.
+
+    python BenchParse.py --dir nhl_data
+"""
+import argparse
+import json
+import os
+from statistics import mean, median
+from time import perf_counter
+from GameStorage import find_games, read_game, parse_game, orjson
+from MockNhlServer import game_feed
+from NhlDB import extract_json
+
+
+def load_contents(directory, games=100):
+    """
+    Uncompressed content of the games in the directory, or of synthetic games.
+    """
+    if os.path.isdir(directory):
+        return [read_game(stored) for stored in find_games(directory)]
+    return [json.dumps(game_feed(2021, 2, game)).encode() for game in range(1, games + 1)]
+
+
+def measure(parse, contents, repeat=5):
+    """
+    Seconds to parse and to extract each game, the best of the repeats
+    """
+    parseTimes = []
+    extractTimes = []
+    records = []
+    for content in contents:
+        bestParse = bestExtract = None
+        for _ in range(repeat):
+            start = perf_counter()
+            jsonData = parse(content)
+            parsed = perf_counter()
+            result = extract_json(jsonData)
+            extracted = perf_counter()
+
+            if bestParse is None or parsed - start < bestParse:
+                bestParse = parsed - start
+            if bestExtract is None or extracted - parsed < bestExtract:
+                bestExtract = extracted - parsed
+        parseTimes.append(bestParse)
+        extractTimes.append(bestExtract)
+        records.append(result)
+    return parseTimes, extractTimes, records
+
+
+def run(directory, games=100, repeat=5):
+    contents = load_contents(directory, games)
+    decoders = {"json (original)": json.loads}
+    if orjson is not None:
+        decoders["parse_game (orjson)"] = parse_game
+
+    results = {}
+    expected = None
+    for name, parse in decoders.items():
+        parseTimes, extractTimes, records = measure(parse, contents, repeat)
+        if expected is None:
+            expected = records
+        elif records != expected:
+            raise RuntimeError(f"{name} extracted different records")
+
+        results[name] = {
+            "files": len(contents),
+            "bytes": sum(len(content) for content in contents),
+            "parseMs": mean(parseTimes) * 1000,
+            "parseMedianMs": median(parseTimes) * 1000,
+            "extractMs": mean(extractTimes) * 1000,
+            "totalMs": (mean(parseTimes) + mean(extractTimes)) * 1000,
+        }
+    return results
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Benchmark the parse time of the game data: ')
+    parser.add_argument(
+        '--dir',
+        type=str,
+        help='Directory containing the game data, synthetic games are used when it does not exist.',
+        default='nhl_data'
+    )
+    parser.add_argument(
+        '--games',
+        type=int,
+        help='Number of synthetic games.',
+        default=100
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        help='Number of times each game is parsed, the best time is kept.',
+        default=5
+    )
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("orjson is not installed, only the json module is measured")
+
+    results = run(args.dir, args.games, args.repeat)
+    baseline = results["json (original)"]
+    for name, result in results.items():
+        print(
+            f"{name:<22} {result['files']:>6} files "
+            f"parse {result['parseMs']:>8.3f} ms/file "
+            f"({baseline['parseMs'] / result['parseMs']:.1f}x) "
+            f"parse + extract {result['totalMs']:>8.3f} ms/file "
+            f"({baseline['totalMs'] / result['totalMs']:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Benchmark of the memory held by the events extracted from the game data.
+
+The original Goalie/Event classes (an instance __dict__ per event, a copy of the
+coordinates and a fromJson call for each of [gameInfo, event, player]) are
+compared with the NamedTuple rows extracted in a single pass by NhlDB.py. The
+games are built by MockNhlServer.py, and the memory and number of allocated
+blocks that are still held after the extraction are measured with tracemalloc.
+
+    python BenchRecords.py --games 50
+"""
+import argparse
+import gc
+import json
+import tracemalloc
+from MockNhlServer import game_feed
+from NhlDB import extract_json, eventTypes
+
+
+class LegacyGoalie:
+
+    def __init__(self, jsonData=None):
+        self.playerId = None
+        self.firstName = None
+        self.lastName = None
+        self.shootsCatches = None
+
+        if jsonData:
+            self.fromJson(jsonData)
+
+    def fromJson(self, jsonData):
+        if "id" in jsonData:
+            self.playerId = str(jsonData["id"])
+        if "firstName" in jsonData:
+            self.firstName = jsonData["firstName"]
+        if "lastName" in jsonData:
+            self.lastName = jsonData["lastName"]
+        if "shootsCatches" in jsonData:
+            self.shootsCatches = jsonData["shootsCatches"]
+
+
+class LegacyEvent:
+
+    def __init__(self, jsonData=None):
+        self.season = None
+        self.gameId = None
+        self.gameType = None
+        self.goaliId = None
+        self.eventId = None
+        self.period = None
+        self.periodType = None
+        self.periodTime = None
+        self.dateTime = None
+        self.coordinates = {}
+        self.eventType = None
+
+        if jsonData:
+            if isinstance(jsonData, list):
+                for x in jsonData:
+                    self.fromJson(x)
+            else:
+                self.fromJson(jsonData)
+
+    def fromJson(self, jsonData):
+        if "about" in jsonData:
+            self.eventId = jsonData["about"]["eventId"]
+            self.period = jsonData["about"]["period"]
+            self.periodType = jsonData["about"]["periodType"]
+            self.periodTime = jsonData["about"]["periodTime"]
+            self.dateTime = jsonData["about"]["dateTime"]
+        if "coordinates" in jsonData:
+            self.coordinates = jsonData["coordinates"]
+        if "result" in jsonData:
+            self.eventType = jsonData["result"]["event"]
+        if "game" in jsonData:
+            self.gameId = str(jsonData["game"]["pk"])
+            self.season = str(jsonData["game"]["season"])
+            self.gameType = jsonData["game"]["type"]
+        if "player" in jsonData:
+            self.goalieId = str(jsonData["player"]["id"])
+
+
+def legacy_extract_json(jsonData):
+    """
+    The original extraction
+    """
+    goalies = {}
+    events = []
+    gameInfo = jsonData["gameData"]
+    for playerId, playerData in jsonData["gameData"]["players"].items():
+        if "primaryPosition" in playerData and "type" in playerData["primaryPosition"]:
+            if playerData["primaryPosition"]["type"] == "Goalie":
+                _playerId = str(playerData["id"])
+                if _playerId not in goalies:
+                    goalies[_playerId] = LegacyGoalie(playerData)
+
+    for event in jsonData["liveData"]["plays"]["allPlays"]:
+        if event["result"]["event"] in eventTypes:
+            for player in event["players"]:
+                if str(player["player"]["id"]) in goalies:
+                    events.append(LegacyEvent([gameInfo, event, player]))
+    return goalies, events
+
+
+def measure(extract, games):
+    """
+    Bytes and allocated blocks still held by the extracted events of the games.
+    Each game is parsed from its text and dropped after the extraction, like
+    NhlDB.py does, so only what the events keep alive is counted.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    extracted = [extract(json.loads(text)) for text in games]
+
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    size = sum(stat.size_diff for stat in stats)
+    blocks = sum(stat.count_diff for stat in stats)
+    events = sum(len(gameEvents) for _, gameEvents in extracted)
+    return {
+        "events": events,
+        "bytes": size,
+        "blocks": blocks,
+        "bytesPerEvent": size / events,
+        "blocksPerEvent": blocks / events,
+    }
+
+
+def run(games=50, plays=300):
+    """
+    Memory held by the events for each way of extracting them
+    """
+    data = [json.dumps(game_feed(2021, 2, game, plays)) for game in range(1, games + 1)]
+    return {
+        "classes (original)": measure(legacy_extract_json, data),
+        "named tuples": measure(extract_json, data),
+    }
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Benchmark the memory held by the extracted events: ')
+    parser.add_argument(
+        '--games',
+        type=int,
+        help='Number of synthetic games to extract.',
+        default=50
+    )
+    parser.add_argument(
+        '--plays',
+        type=int,
+        help='Number of plays in each game.',
+        default=300
+    )
+    args = parser.parse_args()
+
+    results = run(args.games, args.plays)
+    baseline = results["classes (original)"]
+    for name, result in results.items():
+        print(
+            f"{name:<22} {result['events']:>8} events "
+            f"{result['bytesPerEvent']:>8.1f} bytes/event "
+            f"{result['blocksPerEvent']:>6.2f} blocks/event "
+            f"{baseline['bytesPerEvent'] / result['bytesPerEvent']:>5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+End to end benchmark of the scripts against MockNhlServer.py.
+
+Every scenario runs offline in a temporary directory, with the mock server
+running in this process:
+
+    pull     NHLAPIPuller.py pulls a season: games and MB per second
+    ingest   NhlDB.py reads the pulled games into a new database: rows per second
+             and peak RSS
+    query    ShotDatabase (app/database.py) reads the events and the glove/stick
+             sides of every goalie-season: latency percentiles
+    viewer   app/main.py is started offscreen: time to create and show the window
+             and to the first paint, without and with the snapshot of the players
+
+The scripts run in their own process, like they are used, so the peak RSS is the
+one of the script. The results are written as json, compare the results of two
+commits with --compare:
+
+    python Benchmark.py -o before.json
+    python Benchmark.py -o after.json --compare before.json
+
+With --db the query and viewer scenarios use an existing database (e.g. the real
+data) and nothing is pulled.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import datetime, timezone
+from statistics import median
+from time import perf_counter
+from GameStorage import find_games
+from MockNhlServer import create_server
+
+hackDir = os.path.dirname(os.path.abspath(__file__))
+appDir = os.path.join(os.path.dirname(hackDir), "app")
+
+# columns of the event table of the viewer
+EVENT_COLUMNS = [
+    "eventType", "season", "gameType", "goalieId", "period", "periodType",
+    "xCoordinate", "yCoordinate"
+]
+
+# started offscreen by the viewer scenario, the times are from the start of the
+# interpreter and are printed as json
+VIEWER_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+from PyQt5 import QtWidgets
+app = QtWidgets.QApplication(sys.argv[:1])
+import main
+imported = time.perf_counter()
+window = main.MainWindow()
+created = time.perf_counter()
+window.show()
+app.processEvents()
+shown = time.perf_counter()
+while window.firstPaint is None and time.perf_counter() - shown < 10:
+    app.processEvents()
+print(json.dumps({
+    "importSeconds": imported - start,
+    "createSeconds": created - imported,
+    "showSeconds": shown - created,
+    "firstPaintSeconds": (window.firstPaint or time.perf_counter()) - start,
+    "players": window.playerModel.rowCount(),
+}))
+"""
+
+
+def run_process(args, cwd, env=None):
+    """
+    Run the command and wait for it. Returns the output, the wall time and the
+    peak RSS of the process in MB.
+    """
+    with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+        start = perf_counter()
+        process = subprocess.Popen(args, cwd=cwd, env=env, stdout=out, stderr=err)
+        # wait4 returns the resource usage of this process alone
+        _, status, usage = os.wait4(process.pid, 0)
+        seconds = perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        out.seek(0)
+        err.seek(0)
+        if process.returncode != 0:
+            raise RuntimeError(
+                f"{' '.join(args)} exited with {process.returncode}: {err.read().decode()[-2000:]}"
+            )
+        # ru_maxrss is in kB on Linux
+        return out.read().decode(), seconds, usage.ru_maxrss / 1024.0
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50Ms": values[len(values) // 2] * 1000,
+        "p95Ms": values[min(int(len(values) * 0.95), len(values) - 1)] * 1000,
+        "maxMs": values[-1] * 1000,
+        "meanMs": sum(values) / len(values) * 1000,
+    }
+
+
+def bench_pull(workDir, url, concurrency):
+    dataDir = os.path.join(workDir, "nhl_data")
+    _, seconds, maxRss = run_process(
+        [
+            sys.executable, os.path.join(hackDir, "NHLAPIPuller.py"),
+            "--url", url, "-y", "2021", "-c", str(concurrency), "--rate", "0",
+            "--dir", dataDir
+        ],
+        workDir
+    )
+    games = list(find_games(dataDir))
+    size = sum(os.path.getsize(stored.path) for stored in games)
+    return {
+        "games": len(games),
+        "seconds": seconds,
+        "gamesPerSecond": len(games) / seconds,
+        "MBPerSecond": size / 1e6 / seconds,
+        "maxRssMB": maxRss,
+    }
+
+
+def bench_ingest(workDir, dbfile, workers):
+    _, seconds, maxRss = run_process(
+        [
+            sys.executable, os.path.join(hackDir, "NhlDB.py"),
+            "--dir", os.path.join(workDir, "nhl_data"), "--db", dbfile, "-w", str(workers)
+        ],
+        workDir
+    )
+    con = sqlite3.connect(dbfile)
+    rows = con.execute("SELECT COUNT(*) FROM shots").fetchone()[0]
+    con.close()
+    return {
+        "rows": rows,
+        "seconds": seconds,
+        "rowsPerSecond": rows / seconds,
+        "maxRssMB": maxRss,
+        "databaseMB": os.path.getsize(dbfile) / 1e6,
+    }
+
+
+def bench_query(dbfile):
+    """
+    Latency of the reads of the viewer for every goalie-season, each read once and
+    without the cache of the database.
+    """
+    sys.path.append(appDir)
+    from database import ShotDatabase
+
+    database = ShotDatabase(dbfile, cacheSize=1)
+    keys = database.conn.execute(
+        "SELECT DISTINCT goalieId, season FROM shots ORDER BY goalieId, season"
+    ).fetchall()
+
+    seasons = []
+    events = []
+    sides = []
+    for goalieId, season in keys:
+        start = perf_counter()
+        database.seasons(goalieId)
+        seasons.append(perf_counter() - start)
+
+        start = perf_counter()
+        database.events(goalieId, season, EVENT_COLUMNS)
+        events.append(perf_counter() - start)
+
+        if database.hasSides:
+            start = perf_counter()
+            database.sides(goalieId, season)
+            sides.append(perf_counter() - start)
+        database.clear_cache()
+
+    start = perf_counter()
+    if database.hasSides:
+        database.weak_side_gaps()
+    gaps = perf_counter() - start
+    database.close()
+
+    return {
+        "goalieSeasons": len(keys),
+        "seasons": percentiles(seasons),
+        "events": percentiles(events),
+        "sides": percentiles(sides),
+        "weakSideGapsMs": gaps * 1000,
+    }
+
+
+def bench_viewer(dbfile, repeat):
+    """
+    Time to start the viewer and show the window, the median of the runs. The
+    time to the first paint is also given for the first (cold) run.
+    """
+    try:
+        import PyQt5  # noqa: F401
+    except ImportError:
+        return {"skipped": "PyQt5 is not installed"}
+
+    # the viewer opens nhl.db in the working directory
+    runDir = tempfile.mkdtemp(prefix="viewer")
+    try:
+        os.symlink(os.path.abspath(dbfile), os.path.join(runDir, "nhl.db"))
+        env = dict(os.environ, QT_QPA_PLATFORM=os.environ.get("QT_QPA_PLATFORM", "offscreen"))
+
+        runs = []
+        for _ in range(repeat):
+            output, seconds, maxRss = run_process(
+                [sys.executable, "-c", VIEWER_SCRIPT, appDir], runDir, env
+            )
+            run = json.loads(output.strip().splitlines()[-1])
+            run["processSeconds"] = seconds
+            run["maxRssMB"] = maxRss
+            runs.append(run)
+    finally:
+        shutil.rmtree(runDir, ignore_errors=True)
+
+    results = {name: median(run[name] for run in runs) for name in runs[0]}
+    # the first run writes the snapshot of the players, the others start from it
+    results["coldFirstPaintSeconds"] = runs[0]["firstPaintSeconds"]
+    if len(runs) > 1:
+        results["firstPaintSeconds"] = median(run["firstPaintSeconds"] for run in runs[1:])
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=hackDir,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def run(args):
+    results = {"environment": environment(), "config": vars(args).copy(), "scenarios": {}}
+    scenarios = results["scenarios"]
+
+    workDir = args.dir or tempfile.mkdtemp(prefix="nhlbench")
+    os.makedirs(workDir, exist_ok=True)
+    server = None
+    try:
+        dbfile = args.db
+        if dbfile is None:
+            server = create_server(
+                0, args.games, args.latency, args.plays, boxscoreSize=args.boxscore
+            )
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            url = "http://{}:{}/api/v1".format(*server.server_address)
+
+            dbfile = os.path.join(workDir, "nhl.db")
+            if os.path.exists(dbfile):
+                os.remove(dbfile)
+            scenarios["pull"] = bench_pull(workDir, url, args.concurrency)
+            scenarios["ingest"] = bench_ingest(workDir, dbfile, args.workers)
+
+        scenarios["query"] = bench_query(dbfile)
+        scenarios["viewer"] = bench_viewer(dbfile, args.repeat)
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        if args.dir is None:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    return results
+
+
+def flatten(values, prefix=""):
+    """
+    Numeric results by their dotted name
+    """
+    flat = {}
+    for name, value in values.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{name}"] = value
+    return flat
+
+
+def compare(results, baseline):
+    """
+    Table of the change of every result from the baseline
+    """
+    new = flatten(results["scenarios"])
+    old = flatten(baseline["scenarios"])
+    lines = ["{:<32}{:>14}{:>14}{:>10}".format(
+        "result", baseline["environment"].get("commit") or "baseline",
+        results["environment"].get("commit") or "current", "change"
+    )]
+    for name in sorted(new.keys() & old.keys()):
+        change = (new[name] - old[name]) / old[name] * 100 if old[name] else 0.0
+        lines.append("{:<32}{:>14.3f}{:>14.3f}{:>9.1f}%".format(name, old[name], new[name], change))
+
+    # the results are only comparable when the same data was used
+    differ = sorted(
+        name for name in ("games", "plays", "boxscore", "latency", "concurrency", "workers", "db")
+        if results["config"].get(name) != baseline["config"].get(name)
+    )
+    if differ:
+        lines.append("the runs used different settings: {}".format(", ".join(differ)))
+    return "\n".join(lines)
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Benchmark the scripts against a local mock of the api: ')
+    parser.add_argument('--games', type=int, help='Number of games in the season.', default=82)
+    parser.add_argument('--plays', type=int, help='Number of plays in each game.', default=300)
+    parser.add_argument('--boxscore', type=int, help='kB of boxscore data in each game.', default=0)
+    parser.add_argument('--latency', type=float, help='Seconds of delay added to each response.', default=0.0)
+    parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        help='Number of requests in flight at once while pulling.',
+        default=16
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        help='Number of processes used to read the game data.',
+        default=1
+    )
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        help='Number of times the viewer is started, the median is kept.',
+        default=3
+    )
+    parser.add_argument(
+        '--db',
+        type=str,
+        help='Existing database for the query and viewer scenarios, nothing is pulled.',
+        default=None
+    )
+    parser.add_argument(
+        '--dir',
+        type=str,
+        help='Working directory that is kept, a temporary directory is used otherwise.',
+        default=None
+    )
+    parser.add_argument(
+        '-o', '--output',
+        type=str,
+        help='File for the json results, they are printed otherwise.',
+        default=None
+    )
+    parser.add_argument(
+        '--compare',
+        type=str,
+        help='json results of an earlier run to compare with.',
+        default=None
+    )
+    args = parser.parse_args()
+
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as jsonFile:
+            jsonFile.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as jsonFile:
+            print(compare(results, json.load(jsonFile)))
+
+
+if __name__ == "__main__":
+    main()
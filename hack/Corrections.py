@@ -2,16 +2,27 @@
 The script is used for corrections to the available data in the database.
 
 The corrections include the value for shootsCatches to the goalies. Some of
-the data is not found or available during the live game data search. 
+the data is not found or available during the live game data search.
+
+The value is taken from the goalies that NHLAPIPuller.py recorded in the
+manifest of the data directory when any game had it, no request is made for
+these goalies. The remaining goalies are requested from the people endpoint
+concurrently, and the responses are cached on disk so that the next run does not
+request them again. All corrections are written in a single transaction.
 """
+import argparse
 import os
 import sqlite3
-from requests import get
+from concurrent.futures import ThreadPoolExecutor
 from termcolor import colored
-from json import dumps
+from FetchScheduler import FetchScheduler, FetchError, ResponseCache, create_session
+from GameStorage import find_games, load_game
+from PullManifest import PullManifest
+from Schema import migrate
+import instrument
 
-# Base endpoint for people
-NhlPeopleEndpoint = "https://statsapi.web.nhl.com/api/v1/people/"
+# Base endpoint of the api
+NhlApiUrl = "https://statsapi.web.nhl.com/api/v1"
 
 # The database file should be located in ../app
 currentDir = os.path.dirname(os.path.abspath(__file__))
@@ -20,30 +31,178 @@ splitDir.pop()
 currentDir = "/".join(splitDir)
 dbfile = os.path.join(currentDir, "app/nhl.db")
 
-# open the database and read the data to make corrections
-con = sqlite3.connect(dbfile)
-cur = con.cursor()
-
-# test get all players
-cur.execute("SELECT playerId, firstName, lastName, shootsCatches FROM players WHERE shootsCatches='None'")
-rows = cur.fetchall()
+# Responses of the people endpoint, next to this script
+cacheFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "PeopleCache.json")
 
-for row in rows:
-    endpoint = f"{NhlPeopleEndpoint}{row[0]}"
-    print(colored(f"Attempting to correct shootsCatches for {row[1]} {row[2]}", 'green'))
 
+def shoots_catches(jsonData):
+    """
+    shootsCatches from the response of the people endpoint, None when it is missing
+    """
     try:
-        jsonData = get(endpoint).json()
-    except:
-        print(colored(f"failed to find data for {row[1]} {row[2]}", 'red'))
-        continue
+        return jsonData["people"][0].get("shootsCatches")
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def local_corrections(manifest, rows):
+    """
+    Corrections for the players that a game recorded in the manifest had a value
+    for, and the rows that are left.
+    """
+    corrections = {}
+    remaining = []
+    for row in rows:
+        shootsCatches = manifest.players.get(str(row[0]), {}).get("shootsCatches")
+        if shootsCatches is None:
+            remaining.append(row)
+        else:
+            corrections[row[0]] = shootsCatches
+    return corrections, remaining
+
+
+def fetch_corrections(scheduler, url, rows, concurrency=1):
+    """
+    Request the players from the people endpoint. Returns the corrections and the
+    rows that could not be corrected.
+    """
+    def fetch(row):
+        try:
+            return row, scheduler.get_json(f"{url}/people/{row[0]}", endpoint="people"), None
+        except FetchError as e:
+            return row, None, e
+
+    corrections = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        for row, jsonData, error in executor.map(fetch, rows):
+            if error is not None:
+                print(colored(f"failed to retrieve data for {row[1]} {row[2]}: {error}", 'red'))
+                failed.append(row)
+                continue
+
+            shootsCatches = shoots_catches(jsonData)
+            if shootsCatches is None:
+                print(colored(f"failed to find data for {row[1]} {row[2]}", 'red'))
+                failed.append(row)
+                continue
+
+            corrections[row[0]] = shootsCatches
+
+    return corrections, failed
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Correct the player information in the database: ')
+    parser.add_argument(
+        '--dir',
+        type=str,
+        help='Directory containing the game data and the manifest of NHLAPIPuller.py.',
+        default='nhl_data'
+    )
+    parser.add_argument(
+        '--db',
+        type=str,
+        help='Sqlite database file.',
+        default=dbfile
+    )
+    parser.add_argument(
+        '--scan',
+        action='store_true',
+        help='Record the goalies of every stored game in the manifest first (for data '
+             'pulled before the manifest kept them).'
+    )
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='Base url of the api.',
+        default=NhlApiUrl
+    )
+    parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        help='Number of requests in flight at once.',
+        default=8
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        help='Maximum number of requests per second.',
+        default=20.0
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        help='Number of times a failed request is retried.',
+        default=4
+    )
+    parser.add_argument(
+        '--cache',
+        type=str,
+        help='File of the cached people responses.',
+        default=cacheFile
+    )
+    parser.add_argument(
+        '--ttl',
+        type=float,
+        help='Days a cached response is used before it is requested again.',
+        default=30.0
+    )
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    # open the database and read the data to make corrections
+    con = sqlite3.connect(args.db)
+    migrate(con)
+    cur = con.cursor()
+
+    cur.execute("SELECT playerId, firstName, lastName, shootsCatches FROM players WHERE shootsCatches IS NULL")
+    rows = cur.fetchall()
+
+    manifest = PullManifest(args.dir)
+    if args.scan and os.path.isdir(args.dir):
+        with instrument.stage("corrections.scan"):
+            for stored in find_games(args.dir):
+                manifest.record_players(load_game(stored))
+            manifest.save()
+
+    with instrument.stage("corrections.local"):
+        corrections, remaining = local_corrections(manifest, rows)
+    print(colored(f"{len(corrections)} of {len(rows)} players corrected from the game data", 'green'))
+
+    cache = ResponseCache(args.cache, args.ttl * 24 * 3600)
+    scheduler = FetchScheduler(
+        session=create_session(args.concurrency),
+        rate=args.rate,
+        retries=args.retries,
+        cache=cache
+    )
+    with instrument.stage("corrections.fetch"):
+        fetched, failed = fetch_corrections(scheduler, args.url, remaining, args.concurrency)
+    corrections.update(fetched)
+    cache.save()
+
+    # all corrections are written at once
+    with instrument.stage("sqlite.update"):
+        cur.executemany(
+            "UPDATE players SET shootsCatches = ? WHERE playerId = ?",
+            [(shootsCatches, playerId) for playerId, shootsCatches in corrections.items()]
+        )
+        con.commit()
+    instrument.count("corrections", len(corrections))
+    con.close()
+
+    for row in rows:
+        if row[0] in corrections:
+            print(colored(f"Corrected {row[1]} {row[2]} set shootsCatches to {corrections[row[0]]}", 'blue'))
 
-    if "people" in jsonData:
-        if "shootsCatches" in jsonData["people"][0]:
-            shootsCatches = jsonData["people"][0]["shootsCatches"]
-            cur.execute(f"UPDATE players SET shootsCatches = '{shootsCatches}' WHERE playerId = '{row[0]}'")
-            print(colored(f"Corrected {row[1]} {row[2]} set shootsCatches to {shootsCatches}", 'blue'))
+    print(colored(f"{len(corrections)} corrected, {len(failed)} not corrected", 'green'))
+    print(scheduler.report())
 
-con.commit()  # commit all corrections
 
-    
+if __name__ == "__main__":
+    main()
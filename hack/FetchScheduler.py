@@ -0,0 +1,311 @@
+"""
+Shared request scheduling for the scripts that pull from the NHL API.
+
+All requests go through a token bucket so that the sustained request rate stays
+under the rate the API is willing to serve. Transient failures (connection errors,
+timeouts, throttling and server errors) are retried with exponential backoff and
+jitter. Requests that still fail are placed in a bounded retry queue so that they
+can be attempted again at the end of a run instead of being silently dropped.
+
+Responses can be kept in an on disk cache, so that the responses that rarely
+change (e.g. the people endpoint) are not requested again on every run.
+"""
+import os
+import random
+from collections import deque
+from json import dumps, loads
+from threading import Lock
+from time import monotonic, perf_counter, sleep, time
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+import instrument
+
+
+# responses worth trying again, everything else in the 4xx range means the
+# resource does not exist
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+NOT_FOUND_MESSAGE = "Game data couldn't be found"
+
+
+class FetchError(Exception):
+    """
+    Raised when a request could not be completed after all retries.
+    """
+
+
+def create_session(concurrency=1):
+    """
+    Create a keep-alive session. The connection pool is sized so that every
+    concurrent request can reuse its own connection instead of opening a new one.
+    """
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(concurrency, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Tokens are added at `rate` per second up to `burst`,
+    and each request consumes a single token. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst else max(self.rate, 1.0))
+        self.tokens = self.burst
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+
+        while True:
+            with self.lock:
+                now = monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+
+                wait = (1.0 - self.tokens) / self.rate
+            sleep(wait)
+
+
+class EndpointStats:
+    """
+    Latency and error counters for a single endpoint
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.cached = 0
+        self.errors = 0
+        self.retries = 0
+        self.notFound = 0
+        self.bytes = 0
+        self.latency = 0.0
+        self.maxLatency = 0.0
+
+    @property
+    def meanLatency(self):
+        return self.latency / self.requests if self.requests else 0.0
+
+    @property
+    def json(self):
+        return {
+            "requests": self.requests,
+            "cached": self.cached,
+            "errors": self.errors,
+            "retries": self.retries,
+            "notFound": self.notFound,
+            "bytes": self.bytes,
+            "meanLatency": self.meanLatency,
+            "maxLatency": self.maxLatency,
+        }
+
+
+class ResponseCache:
+    """
+    Decoded responses by url, kept in a json file. Entries older than ttl seconds
+    are requested again. Resources that were not found are kept too (as None),
+    so they are not requested on every run either.
+    """
+
+    def __init__(self, filename, ttl=30 * 24 * 3600):
+        self.filename = filename
+        self.ttl = ttl
+        self.entries = {}
+        self.lock = Lock()
+
+        if os.path.exists(filename):
+            with open(filename) as jsonFile:
+                self.entries = loads(jsonFile.read())
+
+    def get(self, url, now=None):
+        """
+        (True, json or None) for a fresh entry, (False, None) when the url has to be
+        requested.
+        """
+        now = time() if now is None else now
+        with self.lock:
+            entry = self.entries.get(url)
+        if entry is None or now - entry["fetched"] > self.ttl:
+            return False, None
+        return True, entry["data"]
+
+    def put(self, url, jsonData, now=None):
+        with self.lock:
+            self.entries[url] = {"fetched": time() if now is None else now, "data": jsonData}
+
+    def save(self):
+        """
+        Write the cache, expired entries are dropped. The file is replaced atomically.
+        """
+        now = time()
+        with self.lock:
+            entries = {
+                url: entry for url, entry in self.entries.items()
+                if now - entry["fetched"] <= self.ttl
+            }
+        tmpFile = "{}.tmp".format(self.filename)
+        with open(tmpFile, "w") as jsonFile:
+            jsonFile.write(dumps(entries))
+        os.replace(tmpFile, self.filename)
+
+
+class FetchScheduler:
+
+    def __init__(
+            self, session=None, rate=20.0, burst=None, retries=4,
+            backoff=0.5, maxBackoff=30.0, retryQueueSize=256, timeout=30.0, cache=None
+    ):
+        self.session = session or create_session()
+        self.cache = cache
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        self.timeout = timeout
+
+        self.retryQueue = deque()
+        self.retryQueueSize = retryQueueSize
+
+        self.stats = {}
+        self.lock = Lock()
+
+    def _stats(self, endpoint):
+        with self.lock:
+            if endpoint not in self.stats:
+                self.stats[endpoint] = EndpointStats()
+            return self.stats[endpoint]
+
+    def _delay(self, attempt, response=None):
+        """
+        Exponential backoff with full jitter. The server is trusted when it says how
+        long to wait.
+        """
+        if response is not None and "Retry-After" in response.headers:
+            try:
+                return min(float(response.headers["Retry-After"]), self.maxBackoff)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.maxBackoff, self.backoff * (2 ** attempt)))
+
+    def _record(self, stats, start, error=False, size=0):
+        elapsed = perf_counter() - start
+        with self.lock:
+            stats.requests += 1
+            stats.bytes += size
+            stats.latency += elapsed
+            stats.maxLatency = max(stats.maxLatency, elapsed)
+            if error:
+                stats.errors += 1
+
+    def get_json(self, url, endpoint="default"):
+        """
+        Request the url and return the decoded json. None is returned when the
+        resource does not exist. FetchError is raised when the request failed
+        after all retries. With a cache, a fresh cached response is returned without
+        a request, and every response is cached.
+        """
+        stats = self._stats(endpoint)
+        error = None
+
+        if self.cache is not None:
+            hit, jsonData = self.cache.get(url)
+            if hit:
+                with self.lock:
+                    stats.cached += 1
+                instrument.count("http.cached")
+                return jsonData
+
+        for attempt in range(self.retries + 1):
+            if attempt:
+                with self.lock:
+                    stats.retries += 1
+
+            with instrument.stage("http.throttle"):
+                self.bucket.acquire()
+            start = perf_counter()
+            response = None
+            try:
+                with instrument.stage("http.request"):
+                    response = self.session.get(url, timeout=self.timeout)
+                if response.status_code in RETRY_STATUS:
+                    raise FetchError("{} returned {}".format(url, response.status_code))
+                if response.status_code >= 400:
+                    jsonData = None
+                else:
+                    # a truncated body fails to decode and is retried
+                    with instrument.stage("http.decode"):
+                        jsonData = response.json()
+            except (RequestException, FetchError, ValueError) as e:
+                self._record(stats, start, error=True)
+                error = e
+                if attempt < self.retries:
+                    sleep(self._delay(attempt, response))
+                continue
+
+            self._record(stats, start, size=len(response.content))
+            instrument.count("http.bytes", len(response.content))
+
+            if jsonData is None or \
+               (isinstance(jsonData, dict) and jsonData.get("message") == NOT_FOUND_MESSAGE):
+                with self.lock:
+                    stats.notFound += 1
+                jsonData = None
+
+            if self.cache is not None:
+                self.cache.put(url, jsonData)
+            return jsonData
+
+        raise FetchError("{} failed after {} attempts: {}".format(url, self.retries + 1, error))
+
+    def defer(self, key, url, endpoint="default"):
+        """
+        Place a failed request in the retry queue. False is returned when the queue
+        is full and the request could not be kept.
+        """
+        with self.lock:
+            if len(self.retryQueue) >= self.retryQueueSize:
+                return False
+            self.retryQueue.append((key, url, endpoint))
+            return True
+
+    def retry_deferred(self):
+        """
+        Generator of (key, json or None, error or None) for every request in the
+        retry queue. The queue is emptied as it is processed.
+        """
+        while True:
+            with self.lock:
+                if not self.retryQueue:
+                    return
+                key, url, endpoint = self.retryQueue.popleft()
+
+            try:
+                yield key, self.get_json(url, endpoint), None
+            except FetchError as e:
+                yield key, None, e
+
+    def report(self):
+        """
+        Per endpoint summary of the requests that were made
+        """
+        lines = ["{:<16}{:>10}{:>8}{:>8}{:>9}{:>10}{:>12}{:>12}{:>12}".format(
+            "endpoint", "requests", "cached", "errors", "retries", "notFound",
+            "kB", "mean (ms)", "max (ms)"
+        )]
+        for endpoint, stats in sorted(self.stats.items()):
+            lines.append("{:<16}{:>10}{:>8}{:>8}{:>9}{:>10}{:>12.1f}{:>12.1f}{:>12.1f}".format(
+                endpoint, stats.requests, stats.cached, stats.errors, stats.retries,
+                stats.notFound, stats.bytes / 1000.0, stats.meanLatency * 1000.0,
+                stats.maxLatency * 1000.0
+            ))
+        return "\n".join(lines)
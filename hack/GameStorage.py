@@ -0,0 +1,215 @@
+"""
+Storage formats for the raw game feeds pulled from the NHL API.
+
+The formats that can be written by NHLAPIPuller.py are:
+
+- json: one pretty printed json file per game (the original format)
+- compact: one json file per game without any whitespace
+- gzip: one gzip compressed, compact json file per game
+- zstd: one zstandard compressed, compact json file per game (requires zstandard)
+- archive: one append only file per season holding a gzip member for each game,
+  with an index of the offset and length of every game
+
+Every format can be read back with find_games and load_game, so the scripts that
+read the data do not need to know how it was stored.
+"""
+import gzip
+import os
+import re
+from json import dumps, loads
+from typing import NamedTuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+FORMATS = ["json", "compact", "gzip", "zstd", "archive"]
+
+ARCHIVE_SUFFIX = ".games.gz"
+INDEX_SUFFIX = ".index.json"
+
+# Game files are named <year>_<game>.json with an optional compression suffix
+GAME_FILE = re.compile(r"^(\d+_\d+\.json)(\.gz|\.zst)?$")
+
+
+class StoredGame(NamedTuple):
+    """
+    Location of a single game. The name is the same for every format
+    (<year>_<game>.json) so that a game is recognized no matter how it was stored.
+    The offset and length are only used for games in an archive.
+    """
+    name: str
+    path: str
+    offset: int = 0
+    length: int = -1
+
+
+def encode(jsonData, fmt):
+    """
+    Serialized json content for the format, before compression.
+    """
+    if fmt == "json":
+        return dumps(jsonData, indent=4).encode()
+    return dumps(jsonData, separators=(",", ":")).encode()
+
+
+class GameWriter:
+
+    def __init__(self, directory, fmt="json"):
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown storage format {fmt}")
+        if fmt == "zstd" and zstandard is None:
+            raise ImportError("the zstandard package is required for the zstd format")
+
+        self.directory = directory
+        self.fmt = fmt
+        self.indexes = {}
+
+        if fmt == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=10)
+
+    def _archive(self, year):
+        """
+        Archive and index files for the season, the index is loaded on first use.
+        """
+        base = os.path.join(self.directory, str(year), str(year))
+        archive = f"{base}{ARCHIVE_SUFFIX}"
+        indexFile = f"{base}{INDEX_SUFFIX}"
+
+        if year not in self.indexes:
+            index = {}
+            if os.path.exists(indexFile):
+                with open(indexFile) as jsonFile:
+                    index = loads(jsonFile.read())
+            self.indexes[year] = index
+
+        return archive, indexFile, self.indexes[year]
+
+    def write(self, year, game, jsonData):
+        """
+        Store the game. The path of the game relative to the directory and the
+        uncompressed content are returned.
+        """
+        name = f"{year}_{game}.json"
+        content = encode(jsonData, self.fmt)
+
+        if self.fmt == "archive":
+            archive, _, index = self._archive(year)
+            member = gzip.compress(content)
+            with open(archive, "ab") as f:
+                offset = f.tell()
+                f.write(member)
+            # an updated game is appended again, the index points at the latest copy
+            index[name] = [offset, len(member)]
+            return f"{year}/{os.path.basename(archive)}#{name}", content
+
+        filename = f"{year}/{name}"
+        data = content
+        if self.fmt == "gzip":
+            filename += ".gz"
+            data = gzip.compress(content)
+        elif self.fmt == "zstd":
+            filename += ".zst"
+            data = self.compressor.compress(content)
+
+        with open(os.path.join(self.directory, filename), "wb") as f:
+            f.write(data)
+
+        return filename, content
+
+    def flush(self):
+        """
+        Write the archive indexes. The index is replaced atomically, games appended
+        after the last flush are simply not indexed yet.
+        """
+        for year, index in self.indexes.items():
+            _, indexFile, _ = self._archive(year)
+            tmpFile = f"{indexFile}.tmp"
+            with open(tmpFile, "w") as jsonFile:
+                jsonFile.write(dumps(index))
+            os.replace(tmpFile, indexFile)
+
+
+def find_games(directory):
+    """
+    Generator of StoredGame for every game in the directory, in any format.
+    """
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            if filename.endswith(INDEX_SUFFIX):
+                archive = os.path.join(root, filename[:-len(INDEX_SUFFIX)] + ARCHIVE_SUFFIX)
+                with open(os.path.join(root, filename)) as jsonFile:
+                    index = loads(jsonFile.read())
+                for name, (offset, length) in index.items():
+                    yield StoredGame(name, archive, offset, length)
+                continue
+
+            match = GAME_FILE.match(filename)
+            if match:
+                yield StoredGame(match.group(1), os.path.join(root, filename))
+
+
+def read_raw(stored):
+    """
+    Bytes of the game as they are stored on disk (possibly compressed).
+    """
+    with open(stored.path, "rb") as f:
+        if stored.length >= 0:
+            f.seek(stored.offset)
+            return f.read(stored.length)
+        return f.read()
+
+
+def stat_game(stored):
+    """
+    Size and modification time of the stored game. For a game in an archive the
+    size is the size of the game and the time is that of the archive.
+    """
+    stat = os.stat(stored.path)
+    size = stat.st_size if stored.length < 0 else stored.length
+    return size, stat.st_mtime
+
+
+def decompress(stored, data):
+    """
+    Uncompressed json content from the stored bytes of the game.
+    """
+    if stored.path.endswith(".gz"):
+        return gzip.decompress(data)
+    if stored.path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError(f"the zstandard package is required to read {stored.path}")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def read_game(stored):
+    """
+    Uncompressed json content of the game.
+    """
+    return decompress(stored, read_raw(stored))
+
+
+def parse_game(data):
+    """
+    Decoded json document from the content (bytes or str) of a game. orjson is
+    used when it is installed, it decodes a game several times faster than the
+    json module and gives the same document.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return loads(data)
+
+
+def load_game(stored):
+    """
+    Decoded json document of the game.
+    """
+    return parse_game(read_game(stored))
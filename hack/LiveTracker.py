@@ -0,0 +1,320 @@
+"""
+Follow games in progress and add their shots to the database as they happen.
+
+NHLAPIPuller.py requests the whole live feed of a game and NhlDB.py reads every
+play of it again. The tracker requests the whole feed of a game once, after that
+it only requests the changes since the time code of the last feed it read (the
+diffPatch endpoint of the api) and reads the plays that were added. When the api
+does not answer with changes the whole feed is requested and only the plays after
+the last one that was read are used.
+
+The new events are written in a single transaction together with the goalie
+side aggregate, the season versions and the number of plays read for the game
+(live_games table), so the viewer always sees a consistent database and a
+restarted tracker continues where it stopped. Changes to plays that were already
+read (e.g. corrected coordinates or an overturned goal) make the tracker read the
+whole feed again, the shots of the game are replaced by the ones of the feed.
+
+    python LiveTracker.py --url http://localhost:8080/api/v1 --games 2021020001 2021020002
+"""
+import argparse
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from time import monotonic, sleep
+from termcolor import colored
+from FetchScheduler import FetchScheduler, FetchError, create_session
+from NhlDB import (
+    dbfile, open_database, extract_json, insert_goalies, insert_events, delete_games,
+    season_keys, refresh_sides, touch_seasons
+)
+import instrument
+
+# Base endpoint of the api
+NhlApiUrl = "https://statsapi.web.nhl.com/api/v1"
+
+# path of a play in the operations of the diffPatch endpoint
+PLAY_PATH = re.compile(r"^/liveData/plays/allPlays/(\d+)(/.*)?$")
+
+FINAL = "Final"
+
+
+class LiveGame:
+    """
+    State of a single game that is followed. Only the game information and the
+    players of the feed are kept, the plays are written to the database.
+    """
+
+    def __init__(self, gameId, plays=0, timeStamp=None, status=None):
+        self.gameId = gameId
+        self.plays = plays
+        self.timeStamp = timeStamp
+        self.status = status
+        self.gameData = None
+
+    @property
+    def final(self):
+        return self.status == FINAL
+
+
+def load_games(cur, gameIds):
+    """
+    Games to follow, with the progress of a previous run
+    """
+    cur.execute("SELECT gameId, plays, timeStamp, status FROM live_games")
+    stored = {row[0]: row for row in cur.fetchall()}
+    return [LiveGame(*stored.get(gameId, (gameId,))) for gameId in gameIds]
+
+
+def save_game(cur, game):
+    cur.execute(
+        """
+        INSERT INTO live_games(gameId, plays, timeStamp, status, updatedAt)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(gameId) DO UPDATE SET
+            plays = excluded.plays,
+            timeStamp = excluded.timeStamp,
+            status = excluded.status,
+            updatedAt = excluded.updatedAt
+        """,
+        (
+            game.gameId, game.plays, game.timeStamp, game.status,
+            datetime.now(timezone.utc).isoformat(timespec="seconds")
+        )
+    )
+
+
+def feed_url(url, gameId):
+    return f"{url}/game/{gameId}/feed/live"
+
+
+def game_status(gameData):
+    return gameData.get("status", {}).get("abstractGameState")
+
+
+def read_feed(game, feed, start):
+    """
+    Keep the game information of a whole feed and return its plays from start.
+    """
+    game.gameData = feed["gameData"]
+    game.status = game_status(game.gameData)
+    game.timeStamp = feed.get("metaData", {}).get("timeStamp")
+    plays = feed["liveData"]["plays"]["allPlays"]
+    return start, plays[start:]
+
+
+def read_diff(game, diffs):
+    """
+    Apply the operations of the diffPatch endpoint to the game. Returns the plays
+    that were added after the last play that was read, or None when the whole feed
+    has to be read again. Operations on anything else than the plays, the players,
+    the status and the time code are not needed for the shots and are skipped.
+    """
+    added = {}
+    for diff in diffs:
+        for operation in diff.get("diff", ()):
+            path = operation.get("path", "")
+            if path == "/metaData/timeStamp":
+                game.timeStamp = operation.get("value")
+            elif path == "/gameData/status":
+                game.status = game_status({"status": operation.get("value", {})})
+            elif path == "/gameData/status/abstractGameState":
+                game.status = operation.get("value")
+            elif path.startswith("/gameData/players") or path.startswith("/gameData/game"):
+                # a new goalie, the players are only kept from a whole feed
+                return None
+            else:
+                match = PLAY_PATH.match(path)
+                if match is None:
+                    if path.startswith("/liveData/plays/allPlays"):
+                        return None
+                    continue
+                index = int(match.group(1))
+                if index < game.plays or match.group(2) or operation.get("op") != "add":
+                    # a play that was read changed
+                    return None
+                added[index] = operation.get("value")
+
+    plays = []
+    for index in sorted(added):
+        if index != game.plays + len(plays):
+            # a play is missing in between
+            return None
+        plays.append(added[index])
+    return plays
+
+
+def poll_game(scheduler, url, game):
+    """
+    Request what changed in the game since the last poll. Returns the index of the
+    first new play and the new plays. This only requests and reads the data, the
+    game is written by the caller.
+    """
+    if game.gameData is not None and game.timeStamp is not None:
+        diffs = scheduler.get_json(
+            f"{feed_url(url, game.gameId)}/diffPatch?startTimecode={game.timeStamp}",
+            endpoint="game/diffPatch"
+        )
+        if isinstance(diffs, list):
+            plays = read_diff(game, diffs)
+            if plays is not None:
+                return game.plays, plays
+
+    feed = scheduler.get_json(feed_url(url, game.gameId), endpoint="game/feed/live")
+    if feed is None:
+        raise FetchError(f"game {game.gameId} was not found")
+
+    # a whole feed after the first one means the plays that were read may have
+    # changed, they are read again
+    start = game.plays if game.gameData is None else 0
+    return read_feed(game, feed, start)
+
+
+def write_plays(con, game, start, plays):
+    """
+    Write the shots of the new plays and the progress of the game in a single
+    transaction. Plays from the start of the game replace the shots the game had,
+    plays that were removed from the feed are removed from the shots too. Returns
+    the number of events that were written.
+    """
+    goalies, events = extract_json({
+        "gameData": game.gameData,
+        "liveData": {"plays": {"allPlays": plays}},
+    })
+
+    cur = con.cursor()
+    keys = delete_games(cur, [game.gameId]) if start == 0 else set()
+    insert_goalies(cur, goalies.values())
+    insert_events(cur, events)
+    keys |= season_keys(events)
+    refresh_sides(cur, keys)
+    touch_seasons(cur, {season for _, season in keys})
+    game.plays = start + len(plays) if start == 0 else max(game.plays, start + len(plays))
+    save_game(cur, game)
+    con.commit()
+    return len(events)
+
+
+def poll(con, scheduler, url, games, concurrency=1):
+    """
+    Poll every game that is not final once. The requests are made concurrently,
+    this thread is the single writer.
+    """
+    active = [game for game in games if not game.final]
+
+    def fetch(game):
+        try:
+            with instrument.stage("live.poll"):
+                return game, poll_game(scheduler, url, game), None
+        except (FetchError, KeyError, TypeError) as e:
+            return game, None, e
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        for game, result, error in executor.map(fetch, active):
+            if error is not None:
+                print(colored(f"failed to poll {game.gameId}: {error}", 'red'))
+                continue
+
+            start, plays = result
+            if not plays and not game.final:
+                # nothing happened, the database is not written
+                continue
+
+            with instrument.stage("live.write"):
+                events = write_plays(con, game, start, plays)
+            instrument.count("plays", len(plays))
+            instrument.count("events", events)
+            print(colored(
+                f"{game.gameId}: {len(plays)} plays, {events} events, "
+                f"{game.plays} plays read ({game.status})",
+                'blue' if game.final else 'green'
+            ))
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Follow games in progress and add their shots to the database: ')
+    parser.add_argument(
+        '--games',
+        type=int,
+        nargs='+',
+        help='Ids of the games to follow, e.g. 2021020001.',
+        required=True
+    )
+    parser.add_argument(
+        '--db',
+        type=str,
+        help='Sqlite database file.',
+        default=dbfile
+    )
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='Base url of the api.',
+        default=NhlApiUrl
+    )
+    parser.add_argument(
+        '--interval',
+        type=float,
+        help='Seconds between the polls of the games.',
+        default=10.0
+    )
+    parser.add_argument(
+        '--once',
+        action='store_true',
+        help='Poll the games a single time.'
+    )
+    parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        help='Number of requests in flight at once.',
+        default=8
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        help='Maximum number of requests per second.',
+        default=20.0
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        help='Number of times a failed request is retried.',
+        default=4
+    )
+    parser.add_argument(
+        '--wal',
+        action='store_true',
+        help='Use write ahead logging for the database, so the viewer is never blocked.'
+    )
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    con = open_database(args.db, args.wal)
+    games = load_games(con.cursor(), args.games)
+    scheduler = FetchScheduler(
+        session=create_session(args.concurrency),
+        rate=args.rate,
+        retries=args.retries
+    )
+
+    try:
+        while True:
+            start = monotonic()
+            poll(con, scheduler, args.url, games, args.concurrency)
+            if args.once or all(game.final for game in games):
+                break
+            sleep(max(args.interval - (monotonic() - start), 0.0))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        con.close()
+
+    print(scheduler.report())
+
+
+if __name__ == "__main__":
+    main()
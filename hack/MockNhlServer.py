@@ -0,0 +1,320 @@
+"""
+Local stand-in for the NHL stats API.
+
+The server answers the live feed endpoint used by NHLAPIPuller.py and the people
+endpoint used by Corrections.py with synthetic, but structurally realistic,
+documents. Point the puller at it with:
+
+    python MockNhlServer.py --port 8080 &
+    python NHLAPIPuller.py --url http://localhost:8080/api/v1 -y 2021 -c 32
+
+With --live-rate the games are in progress when the server starts and gain that
+many plays per second until they are final. The diffPatch endpoint returns the
+changes since a time code, like the NHL API does, for LiveTracker.py.
+
+Real feeds are several hundred kB, mostly the boxscore, use --boxscore to add that
+much data to each feed. Benchmark.py runs the server in process.
+"""
+import argparse
+import re
+import random
+from datetime import datetime, timedelta
+from time import monotonic, sleep
+from json import dumps
+from urllib.parse import parse_qs, urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+NOT_FOUND = {"messageNumber": 2, "message": "Game data couldn't be found"}
+PERSON_NOT_FOUND = {"messageNumber": 10, "message": "Object not found"}
+EVENTS = ["Shot", "Shot", "Shot", "Goal", "Blocked Shot", "Missed Shot", "Faceoff", "Hit"]
+GAME_FEED = re.compile(r"^/api/v1/game/(\d{4})(\d{2})(\d{4})/feed/live/?$")
+DIFF_PATCH = re.compile(r"^/api/v1/game/(\d{4})(\d{2})(\d{4})/feed/live/diffPatch/?$")
+PEOPLE = re.compile(r"^/api/v1/people/(\d+)/?$")
+
+# ids of the players in the games
+GOALIE_IDS = range(8470000, 8470060)
+SKATER_IDS = range(8480000, 8481000)
+
+# time codes count the plays of a live game in seconds from this time
+TIMECODE_BASE = datetime(2021, 10, 12, 23, 0, 0)
+TIMECODE_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def goalie(playerId):
+    """
+    Player document for a goalie
+    """
+    return {
+        "id": playerId,
+        "firstName": "Goalie",
+        "lastName": str(playerId),
+        "primaryPosition": {"code": "G", "name": "Goalie", "type": "Goalie"},
+        "shootsCatches": "L" if playerId % 2 else "R",
+    }
+
+
+def skater(playerId):
+    """
+    Player document for a skater
+    """
+    return {
+        "id": playerId,
+        "firstName": "Skater",
+        "lastName": str(playerId),
+        "primaryPosition": {"code": "C", "name": "Center", "type": "Forward"},
+        "shootsCatches": "L",
+    }
+
+
+def person(playerId):
+    """
+    Response of the people endpoint, None for an unknown player
+    """
+    if playerId in GOALIE_IDS:
+        player = goalie(playerId)
+    elif playerId in SKATER_IDS:
+        player = skater(playerId)
+    else:
+        return None
+    player["fullName"] = "{} {}".format(player["firstName"], player["lastName"])
+    player["active"] = True
+    return {"people": [player]}
+
+
+def boxscore(players, size):
+    """
+    Boxscore with about `size` kB of player statistics
+    """
+    rng = random.Random(size)
+
+    def entry(playerId):
+        return {
+            "person": {"id": playerId, "link": "/api/v1/people/{}".format(playerId)},
+            "stats": {"skaterStats": {
+                name: rng.randrange(10) for name in (
+                    "assists", "goals", "shots", "hits", "powerPlayGoals",
+                    "penaltyMinutes", "faceOffWins", "faceoffTaken", "takeaways",
+                    "giveaways", "blocked", "plusMinus"
+                )
+            }},
+        }
+
+    count = max(size * 1000 // len(dumps(entry(players[0]))), 1)
+    stats = {
+        "ID{}-{}".format(players[i % len(players)], i): entry(players[i % len(players)])
+        for i in range(count)
+    }
+    return {"teams": {"away": {"players": stats}}}
+
+
+def game_feed(year, season_type, game, plays=300, boxscoreSize=0):
+    """
+    Build a live feed document for a game. The content is seeded by the game id so
+    the same game is always served the same way.
+    """
+    gamePk = int("{}{}{}".format(year, str(season_type).zfill(2), str(game).zfill(4)))
+    rng = random.Random(gamePk)
+
+    # a small pool of goalies and skaters so goalies repeat across games
+    goalies = [GOALIE_IDS[rng.randrange(len(GOALIE_IDS))] for _ in range(2)]
+    skaters = [SKATER_IDS[rng.randrange(len(SKATER_IDS))] for _ in range(36)]
+
+    players = {}
+    for playerId in goalies:
+        players["ID{}".format(playerId)] = goalie(playerId)
+    for playerId in skaters:
+        players["ID{}".format(playerId)] = skater(playerId)
+
+    allPlays = []
+    for eventIdx in range(plays):
+        event = rng.choice(EVENTS)
+        period = min(eventIdx * 3 // plays + 1, 3)
+        play = {
+            "result": {"event": event, "eventTypeId": event.upper().replace(" ", "_")},
+            "about": {
+                "eventIdx": eventIdx,
+                "eventId": eventIdx + 1,
+                "period": period,
+                "periodType": "REGULAR",
+                "ordinalNum": "{}".format(period),
+                "periodTime": "{:02d}:{:02d}".format(rng.randrange(20), rng.randrange(60)),
+                "dateTime": "{}-10-12T23:{:02d}:00Z".format(year, eventIdx % 60),
+            },
+            "coordinates": {"x": rng.randrange(-99, 100), "y": rng.randrange(-42, 43)},
+            "players": [
+                {"player": {"id": rng.choice(skaters)}, "playerType": "Shooter"},
+                {"player": {"id": rng.choice(goalies)}, "playerType": "Goalie"},
+            ],
+        }
+        allPlays.append(play)
+
+    feed = {
+        "gamePk": gamePk,
+        "gameData": {
+            "game": {"pk": gamePk, "season": "{}{}".format(year, year + 1), "type": "R"},
+            "status": {"abstractGameState": "Final", "detailedState": "Final"},
+            "players": players,
+        },
+        "liveData": {"plays": {"allPlays": allPlays}},
+    }
+    if boxscoreSize:
+        feed["liveData"]["boxscore"] = boxscore(skaters, boxscoreSize)
+    return feed
+
+
+def timecode(available):
+    return (TIMECODE_BASE + timedelta(seconds=available)).strftime(TIMECODE_FORMAT)
+
+
+def timecode_plays(code):
+    """
+    Number of plays at the time code, 0 when the code is not valid
+    """
+    try:
+        delta = datetime.strptime(code, TIMECODE_FORMAT) - TIMECODE_BASE
+    except (TypeError, ValueError):
+        return 0
+    return max(int(delta.total_seconds()), 0)
+
+
+def live_feed(year, season_type, game, plays, available, boxscoreSize=0):
+    """
+    Live feed document of the game when only the first `available` plays happened.
+    """
+    feed = game_feed(year, season_type, game, plays, boxscoreSize)
+    feed["liveData"]["plays"]["allPlays"] = feed["liveData"]["plays"]["allPlays"][:available]
+    feed["metaData"] = {"timeStamp": timecode(available)}
+    if available < plays:
+        feed["gameData"]["status"] = {"abstractGameState": "Live", "detailedState": "In Progress"}
+    return feed
+
+
+def diff_patch(year, season_type, game, plays, available, start):
+    """
+    JSON patch operations from the time code start to the current state of the
+    game, in the form of the NHL API: a list of {"diff": [operations]}.
+    """
+    start = min(timecode_plays(start), available)
+    if start == available:
+        return []
+
+    feed = live_feed(year, season_type, game, plays, available)
+    operations = [{"op": "replace", "path": "/metaData/timeStamp", "value": timecode(available)}]
+    if available == plays:
+        operations.append({
+            "op": "replace",
+            "path": "/gameData/status",
+            "value": feed["gameData"]["status"],
+        })
+    for index in range(start, available):
+        operations.append({
+            "op": "add",
+            "path": "/liveData/plays/allPlays/{}".format(index),
+            "value": feed["liveData"]["plays"]["allPlays"][index],
+        })
+    return [{"diff": operations}]
+
+
+def make_handler(games, latency, plays, liveRate=0.0, jitter=0.0, boxscoreSize=0):
+    """
+    Create the request handler class for the server configuration.
+    """
+    started = monotonic()
+
+    def available():
+        if not liveRate:
+            return plays
+        return min(plays, int((monotonic() - started) * liveRate))
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_GET(self):
+            if latency or jitter:
+                sleep(latency + random.uniform(0, jitter))
+
+            url = urlsplit(self.path)
+            feed = GAME_FEED.match(url.path)
+            diff = DIFF_PATCH.match(url.path)
+            people = PEOPLE.match(url.path)
+            match = feed or diff
+            status = 200
+            if people:
+                body = person(int(people.group(1)))
+                if body is None:
+                    status = 404
+                    body = PERSON_NOT_FOUND
+            elif not match or not 1 <= int(match.group(3)) <= games:
+                status = 404
+                body = NOT_FOUND
+            elif diff:
+                start = parse_qs(url.query).get("startTimecode", [""])[0]
+                body = diff_patch(
+                    int(match.group(1)), int(match.group(2)), int(match.group(3)),
+                    plays, available(), start
+                )
+            elif liveRate:
+                body = live_feed(
+                    int(match.group(1)), int(match.group(2)), int(match.group(3)),
+                    plays, available(), boxscoreSize
+                )
+            else:
+                body = game_feed(
+                    int(match.group(1)), int(match.group(2)), int(match.group(3)),
+                    plays, boxscoreSize
+                )
+
+            data = dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def create_server(port=0, games=82, latency=0.0, plays=300, liveRate=0.0, jitter=0.0,
+                  boxscoreSize=0):
+    """
+    Create (but do not start) the server. A port of 0 binds to any free port,
+    see server.server_address for the result.
+    """
+    return ThreadingHTTPServer(
+        ("127.0.0.1", port),
+        make_handler(games, latency, plays, liveRate, jitter, boxscoreSize)
+    )
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Serve synthetic NHL API data for local testing: ')
+    parser.add_argument('--port', type=int, help='Port to listen on.', default=8080)
+    parser.add_argument('--games', type=int, help='Number of games in each season.', default=82)
+    parser.add_argument('--latency', type=float, help='Seconds of delay added to each response.', default=0.0)
+    parser.add_argument('--jitter', type=float, help='Random seconds of delay added on top of the latency.', default=0.0)
+    parser.add_argument('--plays', type=int, help='Number of plays in each game.', default=300)
+    parser.add_argument('--boxscore', type=int, help='kB of boxscore data in each game.', default=0)
+    parser.add_argument(
+        '--live-rate',
+        type=float,
+        help='Plays per second of the games in progress, 0 serves final games.',
+        default=0.0
+    )
+    args = parser.parse_args()
+
+    server = create_server(
+        args.port, args.games, args.latency, args.plays, args.live_rate, args.jitter, args.boxscore
+    )
+    print("Serving on http://{}:{}/api/v1".format(*server.server_address))
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,20 @@
 import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from enum import Enum
-from os import mkdir
+from os import makedirs
 from os.path import exists, isdir
 from datetime import datetime
-from requests import get
-from json import dumps
 from json.decoder import JSONDecodeError
 from shutil import rmtree
+from FetchScheduler import FetchScheduler, FetchError, create_session
+from GameStorage import FORMATS, GameWriter
+from PullManifest import PullManifest
+import instrument
 
 
 NHL_FIRST_SEASON = 1917
 MAX_GAME_NUMBER = 1312  # Number of teams * 41 home games
+NHL_API_URL = 'http://statsapi.web.nhl.com/api/v1'
 
 
 class Season(Enum):
@@ -20,6 +24,115 @@ class Season(Enum):
     ALLSTAR = 4
 
 
+def game_id(year, season_type, game):
+    """
+    NHL game id, the year, season type and game number
+    """
+    return '{}{}{}'.format(year, str(season_type).zfill(2), str(game).zfill(4))
+
+
+def game_url(url, year, season_type, game):
+    """
+    Live feed endpoint for a single game
+    """
+    return '{}/game/{}/feed/live'.format(url, game_id(year, season_type, game))
+
+
+def fetch_game(scheduler, url):
+    """
+    Pull the live feed for a single game. None is returned when the game
+    could not be found, FetchError is raised when the request kept failing.
+    """
+    return scheduler.get_json(url, endpoint="game/feed/live")
+
+
+FAILED = object()  # marker for games that could not be pulled
+
+
+def fetch_or_defer(scheduler, url, key):
+    """
+    Pull the game, a game that keeps failing is handed to the retry queue of the
+    scheduler rather than being mistaken for the end of the season.
+    """
+    try:
+        return fetch_game(scheduler, url)
+    except FetchError as e:
+        if scheduler.defer(key, url, endpoint="game/feed/live"):
+            print("Deferred {}: {}".format(key, e))
+        else:
+            print("Lost {}, the retry queue is full: {}".format(key, e))
+        return FAILED
+
+
+def pull_season(scheduler, url, year, season_type, games, concurrency=1):
+    """
+    Generator of (game, json) for each game in the season, in game order. The first
+    missing game is handed back last with None so the caller knows where the season ended.
+
+    At most `concurrency` requests are in flight at any time. The season ends at
+    the first game that cannot be found, so once a game is missing nothing past it
+    is requested, and at most `concurrency - 1` requests are spent beyond the end
+    of the season. Results are handed back in order, which means the games returned
+    are exactly the ones the sequential pull would have returned.
+
+    Games that fail after all retries do not end the season, they are placed in the
+    retry queue of the scheduler and skipped.
+    """
+    games = list(games)
+    end = len(games)  # index of the first missing game
+    next_index = 0
+    yield_index = 0
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        pending = {}
+        while True:
+            # keep the pool full until the end of the season is found
+            while next_index < end and len(pending) < concurrency:
+                future = executor.submit(
+                    fetch_or_defer, scheduler,
+                    game_url(url, year, season_type, games[next_index]),
+                    (year, games[next_index])
+                )
+                pending[future] = next_index
+                next_index += 1
+
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                json_request = future.result()
+                if json_request is None:
+                    end = min(end, index)
+                elif index < end:
+                    results[index] = json_request
+
+            # hand back everything that is complete and in order
+            while yield_index < end and yield_index in results:
+                json_request = results.pop(yield_index)
+                if json_request is not FAILED:
+                    yield games[yield_index], json_request
+                yield_index += 1
+
+    if end < len(games):
+        yield games[end], None
+
+
+def store_game(writer, manifest, year, season_type, game, json_request):
+    """
+    Write the game to the output directory and record it, and its goalies, in the
+    manifest.
+    """
+    with instrument.stage("game.store"):
+        filename, content = writer.write(year, game, json_request)
+    with instrument.stage("game.manifest"):
+        manifest.record(game_id(year, season_type, game), filename, content, json_request)
+        manifest.record_players(json_request)
+    instrument.count("games")
+
+
 def main():
     """
     Main entry point
@@ -52,14 +165,56 @@ def main():
         help='Output directory.',
         default='nhl_data'
     )
+    parser.add_argument(
+        '-c', '--concurrency',
+        type=int,
+        help='Maximum number of requests in flight at once.',
+        default=1
+    )
+    parser.add_argument(
+        '--url',
+        type=str,
+        help='Base url of the NHL API.',
+        default=NHL_API_URL
+    )
+    parser.add_argument(
+        '-r', '--resume',
+        action='store_true',
+        help='Keep the output directory and only pull games that are missing or not final.'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        help='Maximum sustained requests per second, 0 for no limit.',
+        default=20.0
+    )
+    parser.add_argument(
+        '--retries',
+        type=int,
+        help='Number of times a failed request is retried.',
+        default=4
+    )
+    parser.add_argument(
+        '-f', '--format',
+        type=str,
+        help='Storage format of the game data.',
+        choices=FORMATS,
+        default="json"
+    )
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    instrument.setup(args)
 
+    if args.concurrency < 1:
+        parser.error("concurrency must be at least 1")
 
-    # make this an arg
-    if exists(args.dir):
+    if exists(args.dir) and not args.resume:
         rmtree(args.dir)
-    mkdir(args.dir)
-    
+    makedirs(args.dir, exist_ok=True)
+
+    manifest = PullManifest(args.dir)
+    writer = GameWriter(args.dir, args.format)
+
 
     current_year = int(datetime.now().year)
 
@@ -71,11 +226,11 @@ def main():
     except (IndexError, TypeError) as e:
         print(e)
         raise
-    
+
     if "all" in years:
         # rewrite years
         years = [x for x in range(1917, current_year)]
-        
+
     else:
         years_copy = years.copy()
         years = []
@@ -88,10 +243,11 @@ def main():
         # order the years to grab
         years.sort()
 
-    
+
     # adjust the data in games
     games = [x.lower() for x in args.games]
-    if "all" in games:
+    all_games = "all" in games
+    if all_games:
         games = [i+1 for i in range(MAX_GAME_NUMBER)]
     else:
         games_copy = games.copy()
@@ -104,34 +260,66 @@ def main():
 
         # order the games to grab
         games.sort()
-        
+
+    scheduler = FetchScheduler(
+        create_session(args.concurrency),
+        rate=args.rate,
+        burst=args.concurrency,
+        retries=args.retries
+    )
+
     # create all of the json files by pulling the requests from
     # the nhl database
     for year in years:
+        if manifest.season_complete(year, season_type):
+            print("{} (complete)".format(year))
+            continue
+
         _dir = "{}/{}".format(args.dir, year)
-        mkdir(_dir)
+        makedirs(_dir, exist_ok=True)
         print(year)
 
-        for game in games:
-            try:
-                json_request = get(
-                    'http://statsapi.web.nhl.com/api/v1/game/{}{}{}/feed/live'.format(
-                        year, str(season_type).zfill(2), str(game).zfill(4)
-                    )
-                ).json()
-            except:
-                # searched for a game that didn't exit. this is possible for years that
-                # were queried in far in the past
-                break
+        # final games never change, only request what is missing or still live
+        fetch = [x for x in games if manifest.needs_fetch(game_id(year, season_type, x))]
+        last_game = None
 
-            # failed find, continue on
-            if "message" in json_request and json_request["message"] == "Game data couldn't be found":
+        for game, json_request in pull_season(
+                scheduler, args.url, year, season_type, fetch, args.concurrency
+        ):
+            if json_request is None:
+                last_game = max([x for x in games if x < game], default=None)
                 break
-            
-            with open("{}/{}_{}.json".format(_dir, year, game), "w+") as f:
-                f.write(dumps(json_request, indent=4))
+
+            store_game(writer, manifest, year, season_type, game, json_request)
+        else:
+            # every game number was found
+            if fetch:
+                last_game = games[-1]
+
+        # the season can only be complete when every game was requested and the
+        # end of the season was found
+        if all_games and last_game is not None:
+            complete = all(
+                manifest.is_final(game_id(year, season_type, x)) for x in games if x <= last_game
+            )
+            manifest.record_season(year, season_type, last_game, complete)
+
+        writer.flush()
+        manifest.save()
+
+    # one more attempt for the games that kept failing, anything that fails again
+    # is not in the manifest and will be requested by the next --resume
+    for (year, game), json_request, error in scheduler.retry_deferred():
+        if json_request is not None:
+            store_game(writer, manifest, year, season_type, game, json_request)
+        elif error is not None:
+            print("Failed to pull {} game {}: {}".format(year, game, error))
+    writer.flush()
+    manifest.save()
+
+    print(scheduler.report())
 
 
 if __name__ == "__main__":
     main()
-    
+
@@ -7,183 +7,195 @@ Create two tables including the players(goalies) and the events that include:
 - Blocked Shots
 - Goals
 """
+import argparse
 import os
-from json import dumps, loads
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from hashlib import sha256
+from json import loads
 from enum import Enum
+from typing import NamedTuple, Optional
 import sqlite3
+import sys
 from termcolor import colored
 from os.path import exists
+from GameStorage import find_games, read_raw, decompress, parse_game, stat_game
+from Schema import migrate, schema_version, SIDES_SELECT
+import instrument
 
 
 # Assume that the directory is in this same directory as this script
 directory = 'nhl_data'
+# List of files read before the ingest ledger was kept in the database, it is
+# only read to fill the ledger when a database of that time is migrated
 readArtifacts = "ReadFiles.json"
 
-class Goalie:
+class Goalie(NamedTuple):
+    """
+    Row of the players table
+    """
+    playerId: int
+    firstName: Optional[str]
+    lastName: Optional[str]
+    shootsCatches: Optional[str]
 
-    def __init__(self, jsonData=None):
-        self.playerId = None
-        self.firstName = None
-        self.lastName = None
-        self.shootsCatches = None
 
-        if jsonData:
-            self.fromJson(jsonData)
+def goalie_from_json(playerData):
+    return Goalie(
+        int(playerData["id"]),
+        playerData.get("firstName"),
+        playerData.get("lastName"),
+        playerData.get("shootsCatches"),
+    )
 
-    def fromJson(self, jsonData):
-        if "id" in jsonData:
-            self.playerId = str(jsonData["id"])
-        
-        if "firstName" in jsonData:
-            self.firstName = jsonData["firstName"]
 
-        if "lastName" in jsonData:
-            self.lastName = jsonData["lastName"]
-
-        if "shootsCatches" in jsonData:
-            self.shootsCatches = jsonData["shootsCatches"]
-
-    @property
-    def json(self):
-        data = {
-            "id": self.playerId,
-            "firstName": self.firstName,
-            "lastName": self.lastName,
-            "shootsCatches": self.shootsCatches,
-        }
-
-        return data
-
-    
 class EventType(Enum):
     SHOT = 'Shot'
     GOAL = 'Goal'
     BLOCKED_SHOT = 'Blocked Shot'
     MISSED_SHOT = 'Missed Shot'
 
-def eventTypeToStr(eventType):
-    for x in EventType:
-        if x.value == eventType:
-            return x.value
-
-    return None
-
-
-eventTypes = [x.value for x in EventType]
-
-    
-class Event:
-    def __init__(self, jsonData=None):
-        self.season = None
-        self.gameId = None
-        self.gameType = None
-
-        self.goaliId = None
-        
-        self.eventId = None
-        self.period = None
-        self.periodType = None
-        self.periodTime = None
-        self.dateTime = None
-        self.coordinates = {}
-        self.eventType = None
-        
-        if jsonData:
-            if isinstance(jsonData, list):
-                for x in jsonData:
-                    self.fromJson(x)
-            else:
-                self.fromJson(jsonData)
-
-    def fromJson(self, jsonData):
-        if "about" in jsonData:
-            self.eventId = jsonData["about"]["eventId"]
-            self.period = jsonData["about"]["period"]
-            self.periodType = jsonData["about"]["periodType"]
-            self.periodTime = jsonData["about"]["periodTime"]
-            self.dateTime = jsonData["about"]["dateTime"]
-        if "coordinates" in jsonData:
-            self.coordinates = jsonData["coordinates"]
-        if "result" in jsonData:
-            self.eventType = eventTypeToStr(jsonData["result"]["event"])
-
-        if "game" in jsonData:
-            self.gameId = str(jsonData["game"]["pk"])
-            self.season = str(jsonData["game"]["season"])
-            self.gameType = jsonData["game"]["type"]
-
-        if "player" in jsonData:
-            self.goalieId = str(jsonData["player"]["id"])
-
-    @property
-    def json(self):
-        return {
-            "gameId": self.gameId,
-            "season": self.season,
-            "gameType": self.gameType,
-            "period": self.period,
-            "periodType": self.periodType,
-            "periodTime": self.periodTime,
-            "dateTime": self.dateTime,
-            "coordinates": self.coordinates,
-            "eventType": self.eventType,
-            "playerId": self.goalieId
-        }
-            
-
-goalies = {}
-events = []
-readFiles = []
-
-if exists(readArtifacts):
-    with open(readArtifacts) as jsonFile:
-        loadedData = loads(jsonFile.read())
-    if "files" in loadedData:
-        readFiles = loadedData["files"]
-
-
-# Go through the list of files. Make sure that we have all players (these may
-# require some corrections, see Corrections.py for more information). Retrieve
-# all of the events from each game too; these will be added to the database. 
-# 
-# NOTE: Future consideration to only read files that haven't been included
-# in this study yet.
-for root, dirs, files in os.walk(directory):
-    for filename in files:
-        if filename in readFiles:
-            print(colored(f"Skipping {filename}", 'yellow'))
-            continue
-        
-        fname = os.path.join(root, filename)        
-        print(colored(f"processing: {fname}", 'green'))
-
-        jsonData = None
-        with open(fname) as jsonFile:
-            jsonData = loads(jsonFile.read())
-
-        if jsonData:
-
-            gameInfo = jsonData["gameData"]
-
-            # Grab all player data, this will only add the player to the dictionary
-            # if it does not already exist, indicating no wasted updates
-            for playerId, playerData in jsonData["gameData"]["players"].items():
-                if "primaryPosition" in playerData and "type" in playerData["primaryPosition"]:
-                    if playerData["primaryPosition"]["type"] == "Goalie":
-                        _playerId = str(playerData["id"])
-                        if _playerId not in goalies:
-                            goalies[_playerId] = Goalie(playerData)
-
-
-            # All events are unique, so these will all be added to the database
-            for event in jsonData["liveData"]["plays"]["allPlays"]:
-                if event["result"]["event"] in eventTypes:
-                    for player in event["players"]:
-                        if str(player["player"]["id"]) in goalies:
-                            events.append(Event([gameInfo, event, player]))
-
-            # mark the file as read if the Json Data was converted and read correctly
-            readFiles.append(filename)
+# the value of each event type, so that every event shares the same string
+eventTypes = {x.value: x.value for x in EventType}
+
+
+class Event(NamedTuple):
+    """
+    Row of the shots table, an event that a goalie was a part of. Older games did
+    not have coordinates (and the size of the arena was different), the
+    coordinates are None for these events so that the events are still added.
+    """
+    eventType: str
+    season: int
+    gameId: int
+    gameType: Optional[str]
+    goalieId: int
+    eventId: Optional[int]
+    period: Optional[int]
+    periodType: Optional[str]
+    periodTime: Optional[str]
+    dateTime: Optional[str]
+    xCoordinate: Optional[float]
+    yCoordinate: Optional[float]
+
+
+def _shared(value):
+    """
+    A single copy of a string that repeats across many events
+    """
+    return None if value is None else sys.intern(value)
+
+
+def game_pk(jsonData):
+    """
+    Id of the game of the json data, None when there is no data
+    """
+    if not jsonData:
+        return None
+    return int(jsonData["gameData"]["game"]["pk"])
+
+
+def extract_json(jsonData):
+    """
+    Pull out all of the goalies and the events that the goalies were a part of
+    from the json data of a game.
+    """
+    goalies = {}
+    events = []
+
+    if jsonData:
+
+        game = jsonData["gameData"]["game"]
+        season = int(game["season"])
+        gameId = int(game["pk"])
+        gameType = game.get("type")
+
+        # Grab all player data, this will only add the player to the dictionary
+        # if it does not already exist, indicating no wasted updates
+        for playerData in jsonData["gameData"]["players"].values():
+            if playerData.get("primaryPosition", {}).get("type") == "Goalie":
+                playerId = int(playerData["id"])
+                if playerId not in goalies:
+                    goalies[playerId] = goalie_from_json(playerData)
+
+        # All events are unique, so these will all be added to the database. The
+        # fields of each event are read once, and only for the events with a goalie
+        for event in jsonData["liveData"]["plays"]["allPlays"]:
+            eventType = eventTypes.get(event["result"]["event"])
+            if eventType is None:
+                continue
+
+            about = None
+            for player in event["players"]:
+                goalieId = player["player"]["id"]
+                if goalieId not in goalies:
+                    continue
+
+                if about is None:
+                    about = event.get("about", {})
+                    coordinates = event.get("coordinates", {})
+                    # the numbers are kept as they are, the REAL columns store
+                    # them as floats (and small ints are shared objects)
+                    x = coordinates.get("x")
+                    y = coordinates.get("y")
+                    if x is None or y is None:
+                        x = y = None
+
+                events.append(Event(
+                    eventType,
+                    season,
+                    gameId,
+                    gameType,
+                    goalieId,
+                    about.get("eventId"),
+                    about.get("period"),
+                    _shared(about.get("periodType")),
+                    _shared(about.get("periodTime")),
+                    about.get("dateTime"),
+                    x,
+                    y
+                ))
+
+    return goalies, events
+
+
+def extract_game(stored):
+    """
+    Read a single game and extract the id of the game, the goalies and the events.
+    This only depends on the game itself, so it can run in a worker process.
+    """
+    with instrument.stage("game.read"):
+        data = read_raw(stored)
+        digest = sha256(data).hexdigest()
+        data = decompress(stored, data)
+    with instrument.stage("game.decode"):
+        jsonData = parse_game(data)
+    with instrument.stage("game.extract"):
+        goalies, events = extract_json(jsonData)
+    return stored, digest, game_pk(jsonData), goalies, events
+
+
+def extract_games(storedGames, workers=1):
+    """
+    Generator of the extracted data for each game, in the order of the games. With
+    more than one worker the games are extracted in a pool of processes. Only a few
+    games per worker are extracted ahead of the consumer, so the results waiting to
+    be written never grow with the size of the data.
+    """
+    if workers <= 1:
+        yield from map(extract_game, storedGames)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for stored in storedGames:
+            pending.append(executor.submit(extract_game, stored))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
 
 
 # Create the connection to the database - create the file
@@ -196,32 +208,354 @@ currentDir = "/".join(splitDir)
 dbfile = os.path.join(currentDir, "app/nhl.db")
 
 
-con = sqlite3.connect(dbfile)
-cur = con.cursor()
-# only create the tables we need if they dont already exist
-cur.execute("CREATE TABLE IF NOT EXISTS players(playerId, firstName, lastName, shootsCatches)")
-cur.execute("CREATE TABLE IF NOT EXISTS shots(eventType, season, gameId, gameType, goalieId, period, periodType, periodTime, dateTime, xCoordinate, yCoordinate)")
-
-# insert the goalie player information
-for _, goalie in goalies.items():
-    cur.execute(f"INSERT INTO players VALUES(\"{goalie.playerId}\", \"{goalie.firstName}\", \"{goalie.lastName}\", \"{goalie.shootsCatches}\")")
-con.commit()  # commit all goalie information
-
-# insert all event information
-for event in events:
-    # older games did not have coordinates and the size of the arena was different.
-    # Because this data was not tracked it should be nulled out to make sure that the
-    # events are still added to the database
-    if "x" not in event.coordinates or "y" not in event.coordinates:
-        xcoord = ""
-        ycoord = ""
-    else:
-        xcoord = event.coordinates["x"]
-        ycoord = event.coordinates["y"]
-    
-    cur.execute(f"INSERT INTO shots VALUES (\"{event.eventType}\", \"{event.season}\", \"{event.gameId}\", \"{event.gameType}\", \"{event.goalieId}\", \"{event.period}\", \"{event.periodType}\", \"{event.periodTime}\", \"{event.dateTime}\", \"{xcoord}\", \"{ycoord}\")")
-con.commit()  # commit all event information
-
-
-with open("ReadFiles.json", "w") as jsonFile:
-    jsonFile.write(dumps({"files": readFiles}, indent=2))
+def open_database(dbfile, wal=False, synchronous=None, cacheSize=None):
+    """
+    Open the database, the tables are created or migrated to the latest
+    schema (see Schema.py).
+
+    The settings are meant for bulk loads: WAL journaling lets the viewer keep
+    reading while the data is written, synchronous=NORMAL avoids a sync on every
+    commit and a larger page cache (in MB) keeps more of the database in memory.
+    """
+    con = sqlite3.connect(dbfile)
+    cur = con.cursor()
+    if wal:
+        # the mode is returned as a row, it has to be read before the next commit
+        cur.execute("PRAGMA journal_mode=WAL").fetchone()
+    if synchronous:
+        cur.execute(f"PRAGMA synchronous={synchronous}")
+    if cacheSize:
+        # a negative value is the size in KiB rather than in pages
+        cur.execute(f"PRAGMA cache_size=-{int(cacheSize * 1024)}")
+    migrate(con)
+    return con
+
+
+def insert_goalies(cur, goalies):
+    """
+    Add or update the goalie player information in the database. A known value of
+    shootsCatches is never replaced with a missing one.
+    """
+    cur.executemany(
+        """
+        INSERT INTO players(playerId, firstName, lastName, shootsCatches)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(playerId) DO UPDATE SET
+            firstName = excluded.firstName,
+            lastName = excluded.lastName,
+            shootsCatches = COALESCE(excluded.shootsCatches, players.shootsCatches)
+        """,
+        goalies
+    )
+
+
+def delete_games(cur, gameIds):
+    """
+    Remove the shots of the games, so that a game that is read again is replaced
+    rather than merged with the shots it had before (plays can be removed or
+    changed until a game is final). Run this in the same transaction as the new
+    events. Returns the (goalieId, season) keys of the removed shots, their sides
+    have to be counted again.
+    """
+    keys = set()
+    for gameId in gameIds:
+        cur.execute("SELECT DISTINCT goalieId, season FROM shots WHERE gameId = ?", (gameId,))
+        keys.update(cur.fetchall())
+    cur.executemany("DELETE FROM shots WHERE gameId = ?", [(gameId,) for gameId in gameIds])
+    return keys
+
+
+def insert_events(cur, events):
+    """
+    Add the event information to the database. The statement is prepared once and
+    run for every event. Events are keyed by (gameId, eventId, goalieId) so an event
+    that is written again is updated rather than duplicated.
+    """
+    cur.executemany(
+        """
+        INSERT INTO shots(
+            eventType, season, gameId, gameType, goalieId, eventId, period,
+            periodType, periodTime, dateTime, xCoordinate, yCoordinate
+        )
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(gameId, eventId, goalieId) DO UPDATE SET
+            eventType = excluded.eventType,
+            season = excluded.season,
+            gameType = excluded.gameType,
+            period = excluded.period,
+            periodType = excluded.periodType,
+            periodTime = excluded.periodTime,
+            dateTime = excluded.dateTime,
+            xCoordinate = excluded.xCoordinate,
+            yCoordinate = excluded.yCoordinate
+        """,
+        events
+    )
+
+
+def season_keys(events):
+    """
+    (goalieId, season) of every event
+    """
+    return {(event.goalieId, event.season) for event in events}
+
+
+def refresh_sides(cur, keys):
+    """
+    Count the shots and goals to each side again for the (goalieId, season) keys.
+    Run this in the same transaction as the events so that the aggregate always
+    matches the shots table.
+    """
+    keys = list(keys)
+    cur.executemany(
+        "DELETE FROM goalie_season_sides WHERE goalieId = ? AND season = ?", keys
+    )
+    cur.executemany(
+        "INSERT INTO goalie_season_sides "
+        + SIDES_SELECT.format(filter="goalieId = ? AND season = ?"),
+        keys
+    )
+
+
+def touch_seasons(cur, seasons):
+    """
+    Change the version of the seasons, every season with new or changed shots must
+    be touched in the same transaction as the shots.
+    """
+    cur.executemany(
+        """
+        INSERT INTO season_versions(season, version) VALUES (?, 1)
+        ON CONFLICT(season) DO UPDATE SET version = version + 1
+        """,
+        [(season,) for season in seasons]
+    )
+
+
+def ledger_path(stored, directory):
+    """
+    Path of the game in the ingest ledger, relative to the data directory.
+    """
+    path = os.path.relpath(stored.path, directory)
+    if stored.length >= 0:
+        path = f"{path}#{stored.name}"
+    return path
+
+
+def load_ledger(cur):
+    """
+    Size, modification time and hash of every file in the ingest ledger by path.
+    """
+    cur.execute("SELECT path, size, mtime, sha256 FROM ingest_ledger")
+    return {row[0]: row[1:] for row in cur.fetchall()}
+
+
+def record_ledger(cur, path, size, mtime, digest):
+    """
+    Record the file in the ingest ledger. This belongs in the same transaction as
+    the rows that were read from the file.
+    """
+    cur.execute(
+        """
+        INSERT INTO ingest_ledger(path, size, mtime, sha256, ingestedAt)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(path) DO UPDATE SET
+            size = excluded.size,
+            mtime = excluded.mtime,
+            sha256 = excluded.sha256,
+            ingestedAt = excluded.ingestedAt
+        """,
+        (path, size, mtime, digest, datetime.now(timezone.utc).isoformat(timespec="seconds"))
+    )
+
+
+def legacy_database(dbfile):
+    """
+    True for a database written before the schema was versioned that has shots,
+    the files in ReadFiles.json were read into it.
+    """
+    if not exists(dbfile):
+        return False
+
+    con = sqlite3.connect(dbfile)
+    try:
+        if schema_version(con) != 0:
+            return False
+        return con.execute("SELECT 1 FROM shots LIMIT 1").fetchone() is not None
+    except sqlite3.OperationalError:
+        # no shots table
+        return False
+    finally:
+        con.close()
+
+
+def legacy_read_files():
+    """
+    Names of the files listed in ReadFiles.json
+    """
+    if not exists(readArtifacts):
+        return set()
+
+    with open(readArtifacts) as jsonFile:
+        loadedData = loads(jsonFile.read())
+    return set(loadedData.get("files", []))
+
+
+def changed_games(cur, directory, ledger, legacyFiles):
+    """
+    Games in the directory that are not in the ledger or changed since they were
+    read, and the path, size and modification time of each for the ledger. Files
+    that were only touched are recorded in the ledger again.
+    """
+    storedGames = []
+    stamps = {}
+    for stored in find_games(directory):
+        path = ledger_path(stored, directory)
+        size, mtime = stat_game(stored)
+        entry = ledger.get(path)
+
+        if entry is None and stored.name in legacyFiles:
+            record_ledger(cur, path, size, mtime, sha256(read_raw(stored)).hexdigest())
+            print(colored(f"Skipping {stored.name}", 'yellow'))
+            continue
+
+        if entry is not None:
+            if (size, mtime) == (entry[0], entry[1]):
+                print(colored(f"Skipping {stored.name}", 'yellow'))
+                continue
+
+            # the file was touched, only read it again if the content changed
+            digest = sha256(read_raw(stored)).hexdigest()
+            if digest == entry[2]:
+                record_ledger(cur, path, size, mtime, digest)
+                print(colored(f"Skipping {stored.name}", 'yellow'))
+                continue
+
+        storedGames.append(stored)
+        stamps[stored] = (path, size, mtime)
+    return storedGames, stamps
+
+
+def main():
+    """
+    Main entry point
+    """
+    parser = argparse.ArgumentParser('Fill the sqlite database from the NHL game data: ')
+    parser.add_argument(
+        '--dir',
+        type=str,
+        help='Directory containing the game data.',
+        default=directory
+    )
+    parser.add_argument(
+        '--db',
+        type=str,
+        help='Sqlite database file.',
+        default=dbfile
+    )
+    parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        help='Number of processes used to read the game data.',
+        default=1
+    )
+    parser.add_argument(
+        '-b', '--batch',
+        type=int,
+        help='Number of events written between commits, 0 commits after every file.',
+        default=50000
+    )
+    parser.add_argument(
+        '--wal',
+        action='store_true',
+        help='Use write ahead logging for the database.'
+    )
+    parser.add_argument(
+        '--synchronous',
+        type=str,
+        help='SQLite synchronous setting used while loading.',
+        choices=["OFF", "NORMAL", "FULL"],
+        default=None
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        help='SQLite page cache size in MB used while loading.',
+        default=None
+    )
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.setup(args)
+
+    # Files that were read into a database from before the ledger was kept are
+    # trusted to be unchanged, they are added to the ledger without being read
+    # again. Any other database reads every file that is not in its ledger.
+    legacyFiles = legacy_read_files() if legacy_database(args.db) else set()
+
+    con = open_database(args.db, args.wal, args.synchronous, args.cache_size)
+    cur = con.cursor()
+    ledger = load_ledger(cur)
+
+    # Go through the list of files. Make sure that we have all players (these may
+    # require some corrections, see Corrections.py for more information). Retrieve
+    # all of the events from each game too; these will be added to the database.
+    # Files are read again when they changed since they were read.
+    #
+    # The games may be stored in any of the formats written by NHLAPIPuller.py, see
+    # GameStorage.py.
+    with instrument.stage("ingest.scan"):
+        storedGames, stamps = changed_games(cur, args.dir, ledger, legacyFiles)
+    con.commit()
+
+    # The games are read by the workers, this process is the single writer. The
+    # events of each game are written as soon as the game is read, and are committed
+    # in batches. Each file is added to the ledger in the same transaction as its
+    # rows, so a crash only loses the games since the last commit, and those are
+    # read again on the next run.
+    goalies = set()
+    touched = set()
+    pending = 0
+    for stored, digest, gameId, gameGoalies, gameEvents in extract_games(storedGames, args.workers):
+        fname = stored.path if stored.length < 0 else f"{stored.path}#{stored.name}"
+        print(colored(f"processing: {fname}", 'green'))
+
+        # only add the goalie records that have not been seen yet, a later record
+        # of a goalie may fill in the shootsCatches that an earlier one was missing
+        newGoalies = [x for x in gameGoalies.values() if x not in goalies]
+        goalies.update(gameGoalies.values())
+
+        # the shots the game had before it changed are replaced, the goalies and
+        # seasons that are no longer in the game are counted again too
+        with instrument.stage("sqlite.insert"):
+            if gameId is not None:
+                touched.update(delete_games(cur, [gameId]))
+            insert_goalies(cur, newGoalies)
+            insert_events(cur, gameEvents)
+        touched.update(season_keys(gameEvents))
+        pending += len(gameEvents)
+        instrument.count("games")
+        instrument.count("events", len(gameEvents))
+
+        # mark the file as read if the Json Data was converted and read correctly
+        path, size, mtime = stamps.pop(stored)
+        with instrument.stage("sqlite.ledger"):
+            record_ledger(cur, path, size, mtime, digest)
+
+        if pending >= args.batch:
+            with instrument.stage("sqlite.sides"):
+                refresh_sides(cur, touched)
+                touch_seasons(cur, {season for _, season in touched})
+            with instrument.stage("sqlite.commit"):
+                con.commit()
+            touched.clear()
+            pending = 0
+
+    with instrument.stage("sqlite.sides"):
+        refresh_sides(cur, touched)
+        touch_seasons(cur, {season for _, season in touched})
+    with instrument.stage("sqlite.commit"):
+        con.commit()
+    con.close()
+
+
+if __name__ == "__main__":
+    main()
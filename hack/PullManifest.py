@@ -0,0 +1,167 @@
+"""
+On disk record of the games that have been pulled from the NHL API.
+
+The manifest lives in the output directory of NHLAPIPuller.py and is used to
+resume or refresh a pull without downloading the whole history again. For every
+game it holds the time the game was fetched, a hash of the stored content and
+whether the game was final. Games that are final never change, so they are never
+requested again.
+
+The manifest also keeps the goalies found in gameData.players of the games, so
+that Corrections.py can fill in player information without a request.
+"""
+import os
+from datetime import datetime, timezone
+from hashlib import sha256
+from json import dumps, loads
+
+
+MANIFEST_FILE = "manifest.json"
+
+
+class GameStatus:
+    FINAL = "final"
+    LIVE = "live"
+    PREVIEW = "preview"
+
+
+def game_status(jsonData):
+    """
+    Status of the game from the live feed document.
+    """
+    try:
+        state = jsonData["gameData"]["status"]["abstractGameState"]
+    except (KeyError, TypeError):
+        return GameStatus.LIVE
+
+    if state == "Final":
+        return GameStatus.FINAL
+    elif state == "Preview":
+        return GameStatus.PREVIEW
+    return GameStatus.LIVE
+
+
+def game_start(jsonData):
+    """
+    Scheduled start of the game from the live feed document, None when unknown.
+    """
+    try:
+        return jsonData["gameData"]["datetime"]["dateTime"]
+    except (KeyError, TypeError):
+        return None
+
+
+def content_hash(content):
+    """
+    Hash of the content that was written for a game
+    """
+    if isinstance(content, str):
+        content = content.encode()
+    return sha256(content).hexdigest()
+
+
+class PullManifest:
+
+    def __init__(self, directory):
+        self.filename = os.path.join(directory, MANIFEST_FILE)
+        self.games = {}
+        self.seasons = {}
+        self.players = {}
+
+        if os.path.exists(self.filename):
+            with open(self.filename) as jsonFile:
+                loadedData = loads(jsonFile.read())
+            self.games = loadedData.get("games", {})
+            self.seasons = loadedData.get("seasons", {})
+            self.players = loadedData.get("players", {})
+
+    @staticmethod
+    def season_key(year, season_type):
+        return "{}{}".format(year, str(season_type).zfill(2))
+
+    def needs_fetch(self, gameId, now=None):
+        """
+        Only games that are missing, live, or scheduled to have started by now need
+        to be requested. Final games never change.
+        """
+        entry = self.games.get(str(gameId))
+        if entry is None:
+            return True
+
+        if entry["status"] == GameStatus.FINAL:
+            return False
+
+        if entry["status"] == GameStatus.PREVIEW and entry.get("start"):
+            now = now or datetime.now(timezone.utc)
+            try:
+                start = datetime.fromisoformat(entry["start"].replace("Z", "+00:00"))
+            except ValueError:
+                return True
+            return start <= now
+
+        return True
+
+    def is_final(self, gameId):
+        entry = self.games.get(str(gameId))
+        return entry is not None and entry["status"] == GameStatus.FINAL
+
+    def record(self, gameId, filename, content, jsonData):
+        """
+        Record a game that was written to disk.
+        """
+        entry = {
+            "file": filename,
+            "fetched": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "sha256": content_hash(content),
+            "status": game_status(jsonData),
+        }
+        if entry["status"] == GameStatus.PREVIEW:
+            entry["start"] = game_start(jsonData)
+
+        self.games[str(gameId)] = entry
+
+    def record_players(self, jsonData):
+        """
+        Record the goalies of a game. A known value is never replaced with a missing
+        one.
+        """
+        try:
+            players = jsonData["gameData"]["players"].values()
+        except (KeyError, TypeError, AttributeError):
+            return
+
+        for playerData in players:
+            if playerData.get("primaryPosition", {}).get("type") != "Goalie":
+                continue
+
+            entry = self.players.setdefault(str(playerData["id"]), {})
+            for key in ("firstName", "lastName", "shootsCatches"):
+                if playerData.get(key) is not None:
+                    entry[key] = playerData[key]
+
+    def season_complete(self, year, season_type):
+        season = self.seasons.get(self.season_key(year, season_type))
+        return season is not None and season.get("complete", False)
+
+    def record_season(self, year, season_type, lastGame, complete):
+        """
+        Record the last game found in a season. A season is complete when the end of
+        the season has been found and every game in it is final.
+        """
+        self.seasons[self.season_key(year, season_type)] = {
+            "lastGame": lastGame,
+            "complete": complete,
+        }
+
+    def save(self):
+        """
+        Write the manifest. The file is replaced atomically so that an interrupted
+        pull never leaves a partial manifest behind.
+        """
+        tmpFile = "{}.tmp".format(self.filename)
+        with open(tmpFile, "w") as jsonFile:
+            jsonFile.write(dumps(
+                {"games": self.games, "seasons": self.seasons, "players": self.players},
+                indent=2
+            ))
+        os.replace(tmpFile, self.filename)
@@ -0,0 +1,261 @@
+"""
+Versioned schema for the sqlite database.
+
+The version of the schema is kept in the user_version of the database. Each
+migration moves the database up a single version, and migrate runs every
+migration the database has not seen yet. Add a new migration to the end of
+MIGRATIONS to change the schema.
+"""
+
+
+def _table_exists(cur, name):
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (name,))
+    return cur.fetchone() is not None
+
+
+def _typed_tables(cur):
+    """
+    Version 1: typed columns, NULL for missing values, a unique key for each
+    event and indexes for the per goalie and per season queries.
+
+    The original tables were created without types, every value was stored as text
+    and missing values were stored as "" or "None". The rows are copied into the
+    typed tables. The original rows have no event id, duplicate copies of them
+    (from reading the same file twice) are removed while copying, and they are
+    replaced the next time the game is read.
+    """
+    legacyPlayers = _table_exists(cur, "players")
+    legacyShots = _table_exists(cur, "shots")
+    if legacyPlayers:
+        cur.execute("ALTER TABLE players RENAME TO players_v0")
+    if legacyShots:
+        cur.execute("ALTER TABLE shots RENAME TO shots_v0")
+
+    cur.execute("""
+        CREATE TABLE players(
+            playerId INTEGER PRIMARY KEY,
+            firstName TEXT,
+            lastName TEXT,
+            shootsCatches TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE shots(
+            eventType TEXT NOT NULL,
+            season INTEGER NOT NULL,
+            gameId INTEGER NOT NULL,
+            gameType TEXT,
+            goalieId INTEGER NOT NULL,
+            eventId INTEGER,
+            period INTEGER,
+            periodType TEXT,
+            periodTime TEXT,
+            dateTime TEXT,
+            xCoordinate REAL,
+            yCoordinate REAL
+        )
+    """)
+    cur.execute("CREATE UNIQUE INDEX shots_event ON shots(gameId, eventId, goalieId)")
+    cur.execute("CREATE INDEX shots_goalie_season ON shots(goalieId, season)")
+    cur.execute("CREATE INDEX shots_season_type ON shots(season, eventType)")
+
+    if legacyPlayers:
+        cur.execute("""
+            INSERT INTO players(playerId, firstName, lastName, shootsCatches)
+            SELECT CAST(playerId AS INTEGER), NULLIF(firstName, 'None'),
+                   NULLIF(lastName, 'None'), NULLIF(shootsCatches, 'None')
+            FROM players_v0 WHERE true
+            ON CONFLICT(playerId) DO UPDATE SET
+                shootsCatches = COALESCE(excluded.shootsCatches, players.shootsCatches)
+        """)
+        cur.execute("DROP TABLE players_v0")
+
+    if legacyShots:
+        cur.execute("""
+            INSERT INTO shots(
+                eventType, season, gameId, gameType, goalieId, period,
+                periodType, periodTime, dateTime, xCoordinate, yCoordinate
+            )
+            SELECT DISTINCT eventType, CAST(season AS INTEGER), CAST(gameId AS INTEGER),
+                   NULLIF(gameType, 'None'), CAST(goalieId AS INTEGER),
+                   CAST(NULLIF(period, 'None') AS INTEGER), NULLIF(periodType, 'None'),
+                   NULLIF(periodTime, 'None'), NULLIF(dateTime, 'None'),
+                   CAST(NULLIF(xCoordinate, '') AS REAL), CAST(NULLIF(yCoordinate, '') AS REAL)
+            FROM shots_v0
+        """)
+        cur.execute("DROP TABLE shots_v0")
+
+
+def _ingest_ledger(cur):
+    """
+    Version 2: ledger of the game files that have been read into the database.
+
+    The path is relative to the data directory (with #<name> appended for a game in
+    an archive). The size and modification time are used to notice that a file
+    changed, and the hash decides whether it really did.
+    """
+    cur.execute("""
+        CREATE TABLE ingest_ledger(
+            path TEXT PRIMARY KEY,
+            size INTEGER,
+            mtime REAL,
+            sha256 TEXT,
+            ingestedAt TEXT
+        )
+    """)
+
+
+# Shots and goals to each side of the goalie for the events of the shots table
+# that match the filter, grouped by goalie and season. Only events with both
+# coordinates are counted (events is the number of them), and only goals, shots
+# and blocked shots are shots. A shot from (+x, +y) or (-x, -y) is to the left
+# of the goalie, any other shot is to the right.
+SIDES_SELECT = """
+    SELECT goalieId, season, COUNT(*),
+           SUM(isShot AND isLeft), SUM(isGoal AND isLeft),
+           SUM(isShot AND NOT isLeft), SUM(isGoal AND NOT isLeft)
+    FROM (
+        SELECT goalieId, season,
+               eventType IN ('Goal', 'Blocked Shot', 'Shot') AS isShot,
+               eventType = 'Goal' AS isGoal,
+               (xCoordinate >= 0 AND yCoordinate >= 0)
+                   OR (xCoordinate < 0 AND yCoordinate < 0) AS isLeft
+        FROM shots
+        WHERE xCoordinate IS NOT NULL AND yCoordinate IS NOT NULL AND ({filter})
+    )
+    GROUP BY goalieId, season
+"""
+
+
+def _goalie_season_sides(cur):
+    """
+    Version 3: shots and goals to each side for every goalie and season.
+
+    The table is kept up to date by NhlDB.py as games are read, the viewer reads
+    a single row instead of every event of the season. The sides are stored as
+    left/right, which side is the glove depends on shootsCatches of the player.
+    """
+    cur.execute("""
+        CREATE TABLE goalie_season_sides(
+            goalieId INTEGER NOT NULL,
+            season INTEGER NOT NULL,
+            events INTEGER NOT NULL,
+            leftShots INTEGER NOT NULL,
+            leftGoals INTEGER NOT NULL,
+            rightShots INTEGER NOT NULL,
+            rightGoals INTEGER NOT NULL,
+            PRIMARY KEY(goalieId, season)
+        ) WITHOUT ROWID
+    """)
+    cur.execute(
+        "INSERT INTO goalie_season_sides " + SIDES_SELECT.format(filter="true")
+    )
+
+
+def _season_versions(cur):
+    """
+    Version 4: a version number for each season that changes every time shots of
+    the season are written.
+
+    Copies of the shots (e.g. the column store of the viewer) compare the version to
+    find the seasons they need to read again. NhlDB.py updates the versions in the
+    same transaction as the shots.
+    """
+    cur.execute("""
+        CREATE TABLE season_versions(
+            season INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+    cur.execute(
+        "INSERT INTO season_versions(season, version) SELECT DISTINCT season, 1 FROM shots"
+    )
+
+
+def _live_games(cur):
+    """
+    Version 5: progress of LiveTracker.py in the games it follows.
+
+    plays is the number of plays of the game that were read into the shots table,
+    and timeStamp the time code of the feed at that point, so that only the plays
+    after it are requested again.
+    """
+    cur.execute("""
+        CREATE TABLE live_games(
+            gameId INTEGER PRIMARY KEY,
+            plays INTEGER NOT NULL,
+            timeStamp TEXT,
+            status TEXT,
+            updatedAt TEXT
+        )
+    """)
+
+
+def _table_versions(cur):
+    """
+    Version 6: a version number for the players table that changes every time a
+    player is added, removed or changed.
+
+    The viewer shows a snapshot of the player list at startup and only trusts it
+    while the version is the same. The version is kept by triggers, so every script
+    that writes the players keeps it up to date. An upsert that does not change the
+    player does not change the version.
+    """
+    cur.execute("""
+        CREATE TABLE table_versions(
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+    cur.execute("INSERT INTO table_versions(name, version) VALUES ('players', 1)")
+
+    bump = "UPDATE table_versions SET version = version + 1 WHERE name = 'players';"
+    cur.execute(f"CREATE TRIGGER players_insert AFTER INSERT ON players BEGIN {bump} END")
+    cur.execute(f"CREATE TRIGGER players_delete AFTER DELETE ON players BEGIN {bump} END")
+    cur.execute(f"""
+        CREATE TRIGGER players_update AFTER UPDATE ON players
+        WHEN old.playerId IS NOT new.playerId
+            OR old.firstName IS NOT new.firstName
+            OR old.lastName IS NOT new.lastName
+            OR old.shootsCatches IS NOT new.shootsCatches
+        BEGIN {bump} END
+    """)
+
+
+# Migration functions in order, the index + 1 is the version they produce
+MIGRATIONS = [
+    _typed_tables,
+    _ingest_ledger,
+    _goalie_season_sides,
+    _season_versions,
+    _live_games,
+    _table_versions,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(con):
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(con):
+    """
+    Bring the database up to the latest version of the schema. Every migration
+    runs in its own transaction together with the version update.
+    """
+    version = schema_version(con)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"database schema version {version} is newer than this script ({SCHEMA_VERSION})"
+        )
+
+    for index in range(version, SCHEMA_VERSION):
+        cur = con.cursor()
+        cur.execute("BEGIN")
+        try:
+            MIGRATIONS[index](cur)
+            cur.execute(f"PRAGMA user_version={index + 1}")
+        except Exception:
+            con.rollback()
+            raise
+        con.commit()
@@ -0,0 +1,247 @@
+"""
+Timing and counters for the stages of the scripts and the viewer.
+
+The instrumentation is off unless it is enabled with the options of a script
+(see add_arguments) or with the environment:
+
+    NHL_INSTRUMENT=1        print the time spent in every stage at exit
+    NHL_PROFILE=out.prof    profile the main thread with cProfile, read the file
+                            with pstats or snakeviz
+    NHL_TRACE=trace.json    write every stage as a Chrome trace, open the file in
+                            chrome://tracing or https://ui.perfetto.dev
+
+When it is off, stage() returns a shared context manager that does nothing, so
+the stages stay in the code at the cost of a function call. Stages may be nested
+and may run in any thread, the time of a nested stage is also part of the stage
+around it, and the stages of concurrent threads can add up to more than the wall
+time. Stages in worker processes (NhlDB.py -w) are not collected.
+
+    with instrument.stage("sqlite.insert"):
+        insert_events(cur, events)
+    instrument.count("events", len(events))
+
+The viewer imports this module from the hack directory.
+"""
+import atexit
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+from time import perf_counter
+
+
+enabled = False
+
+_lock = threading.Lock()
+_started = perf_counter()
+_stages = {}  # name: [calls, seconds, max seconds]
+_counters = {}
+_summary = False
+_trace = None  # completed stages when a trace is written
+_tracePath = None
+_profiler = None
+_profilePath = None
+_finished = False
+
+
+class _NullStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, perf_counter())
+        return False
+
+
+def record(name, start, end):
+    """
+    Add a stage that ran from start to end (perf_counter times), for stages that
+    do not fit in a with block
+    """
+    if not enabled:
+        return
+
+    elapsed = end - start
+    with _lock:
+        stats = _stages.get(name)
+        if stats is None:
+            stats = _stages[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
+
+        if _trace is not None:
+            _trace.append({
+                "name": name,
+                "ph": "X",
+                "ts": (start - _started) * 1e6,
+                "dur": elapsed * 1e6,
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+            })
+
+
+def stage(name):
+    """
+    Context manager that times the code in it as the stage
+    """
+    if not enabled:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def timed(name):
+    """
+    Decorator that times every call of the function as the stage
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with _Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, value=1):
+    """
+    Add the value to the counter
+    """
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+
+def summary():
+    """
+    Table of the calls and time of every stage, and the counters
+    """
+    wall = perf_counter() - _started
+    with _lock:
+        stages = sorted(_stages.items(), key=lambda item: item[1][1], reverse=True)
+        counters = sorted(_counters.items())
+
+    lines = ["{:<24}{:>10}{:>12}{:>12}{:>12}{:>8}".format(
+        "stage", "calls", "total (ms)", "mean (ms)", "max (ms)", "% wall"
+    )]
+    for name, (calls, seconds, maxSeconds) in stages:
+        lines.append("{:<24}{:>10}{:>12.1f}{:>12.3f}{:>12.3f}{:>8.1f}".format(
+            name, calls, seconds * 1000, seconds / calls * 1000, maxSeconds * 1000,
+            seconds / wall * 100 if wall else 0.0
+        ))
+    for name, value in counters:
+        lines.append("{:<24}{:>10}".format(name, value))
+    lines.append("{:<24}{:>22.1f}".format("wall", wall * 1000))
+    return "\n".join(lines)
+
+
+def enable(showSummary=True, profile=None, trace=None):
+    """
+    Start collecting, the results are written when the process exits
+    """
+    global enabled, _started, _summary, _trace, _tracePath, _profiler, _profilePath
+
+    with _lock:
+        _started = perf_counter()
+        _stages.clear()
+        _counters.clear()
+        _summary = showSummary
+        _tracePath = trace
+        _trace = [] if trace else None
+        _profilePath = profile
+
+    if profile and _profiler is None:
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+    if not enabled:
+        atexit.register(finish)
+    enabled = True
+
+
+def finish():
+    """
+    Stop collecting and write the summary, the profile and the trace
+    """
+    global enabled, _profiler, _finished
+    if not enabled or _finished:
+        return
+    _finished = True
+
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(_profilePath)
+        _profiler = None
+        print(f"profile written to {_profilePath}", file=sys.stderr)
+
+    if _tracePath:
+        with _lock:
+            events = list(_trace)
+        with open(_tracePath, "w") as traceFile:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, traceFile)
+        print(f"trace written to {_tracePath}", file=sys.stderr)
+
+    if _summary:
+        print(summary(), file=sys.stderr)
+    enabled = False
+
+
+def add_arguments(parser):
+    """
+    Add the options that enable the instrumentation to the parser of a script
+    """
+    parser.add_argument(
+        '--instrument',
+        action='store_true',
+        help='Print the time spent in every stage at exit.'
+    )
+    parser.add_argument(
+        '--profile',
+        type=str,
+        help='Write a cProfile profile of the main thread to the file.',
+        default=None
+    )
+    parser.add_argument(
+        '--trace',
+        type=str,
+        help='Write the stages as a Chrome trace to the file.',
+        default=None
+    )
+
+
+def setup(args=None):
+    """
+    Enable the instrumentation when the options (see add_arguments) or the
+    environment ask for it.
+    """
+    showSummary = bool(getattr(args, "instrument", False)) or \
+        os.environ.get("NHL_INSTRUMENT", "") not in ("", "0")
+    profile = getattr(args, "profile", None) or os.environ.get("NHL_PROFILE") or None
+    trace = getattr(args, "trace", None) or os.environ.get("NHL_TRACE") or None
+
+    if showSummary or profile or trace:
+        enable(showSummary, profile, trace)
@@ -0,0 +1,78 @@
+"""
+Tests of the concurrent puller against MockNhlServer.py, run from the hack
+directory with:
+
+    python -m pytest test_NHLAPIPuller.py
+"""
+import sys
+import threading
+import pytest
+from FetchScheduler import FetchScheduler, create_session
+from MockNhlServer import create_server
+import NHLAPIPuller
+from NHLAPIPuller import Season, pull_season
+
+GAMES = 10
+YEAR = 2021
+
+
+@pytest.fixture
+def server():
+    """
+    Mock api with a season of GAMES games, counting the requests it answers
+    """
+    server = create_server(0, games=GAMES)
+    server.requests = 0
+    lock = threading.Lock()
+
+    class CountingHandler(server.RequestHandlerClass):
+        def do_GET(self):
+            with lock:
+                server.requests += 1
+            super().do_GET()
+
+    server.RequestHandlerClass = CountingHandler
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server.url = "http://{}:{}/api/v1".format(*server.server_address)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("concurrency", [1, 4, 16])
+def test_pull_season_in_order(server, concurrency):
+    scheduler = FetchScheduler(create_session(concurrency), rate=0, retries=0)
+    pulled = list(pull_season(
+        scheduler, server.url, YEAR, Season.REGULAR.value,
+        range(1, NHLAPIPuller.MAX_GAME_NUMBER + 1), concurrency
+    ))
+
+    # the games of the season in order, then the first missing game
+    assert [game for game, _ in pulled] == list(range(1, GAMES + 2))
+    assert all(json_request is not None for _, json_request in pulled[:-1])
+    assert pulled[-1][1] is None
+    assert [json_request["gamePk"] for _, json_request in pulled[:-1]] == [
+        int(NHLAPIPuller.game_id(YEAR, Season.REGULAR.value, game)) for game in range(1, GAMES + 1)
+    ]
+
+    # the games of the season, the first missing game and at most concurrency - 1
+    # requests past it
+    assert GAMES + 1 <= server.requests <= GAMES + concurrency
+
+
+def test_resume_makes_no_requests(server, tmp_path, monkeypatch):
+    args = [
+        "NHLAPIPuller.py", "--url", server.url, "-y", str(YEAR), "-c", "4",
+        "--rate", "0", "--dir", str(tmp_path / "nhl_data")
+    ]
+
+    monkeypatch.setattr(sys, "argv", args)
+    NHLAPIPuller.main()
+    pulled = server.requests
+    assert pulled >= GAMES + 1
+    assert len(list((tmp_path / "nhl_data" / str(YEAR)).iterdir())) == GAMES
+
+    # every game is final and the end of the season is known
+    monkeypatch.setattr(sys, "argv", args + ["--resume"])
+    NHLAPIPuller.main()
+    assert server.requests == pulled